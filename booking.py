@@ -4,14 +4,19 @@ import re
 from selenium.webdriver import ActionChains
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
-from selenium.webdriver.support.ui import Select
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, StaleElementReferenceException
+from selenium.webdriver.support.ui import Select, WebDriverWait
 from typing import Optional
 import logging
-import time
 
 # 📑 Modelos e lifespan
-from code_sup import similar
+from code_sup import similar, normalizar_nome
+
+# 🗓️ Grade de horários
+from grade_utils import extrair_grade
+
+# ⏱ Esperas
+from wait_utils import aguardar_mudanca, aguardar_ajax_ocioso, LIMITE_ESPERA
 
 # # 📆 Horários e datas
 # from date_times import extrair_horarios_de_bloco
@@ -32,69 +37,100 @@ def extrair_consultorio_do_bloco(bloco) -> Optional[str]:
         return None
 
 
-def buscar_bloco_do_profissional(driver, blocos, nome_profissional: str, especialidade: str):
+def indexar_blocos(driver) -> dict[str, list[tuple[str, str]]]:
     """
-    Busca o bloco do profissional específico, com a especialidade e horário desejado.
-    Retorna o bloco correspondente ou None.
+    Lê a grade em uma única passada e monta o índice
+    nome normalizado do profissional -> [(especialidade normalizada, id do bloco)].
     """
-    time.sleep(3)
-    for index, bloco in enumerate(blocos):
-        time.sleep(1)
-        resultados = []
-        max_tentativas = 3
-        resultado_valido = None  # variável para guardar o primeiro resultado não nulo
+    aguardar_ajax_ocioso(driver)
+    indice: dict[str, list[tuple[str, str]]] = {}
 
-        for tentativa in range(max_tentativas):
-            try:
-                painel = bloco.find_elements(By.CSS_SELECTOR, ".panel-title")
-                if painel:
-                    linhas = painel[0].text.strip().split("\n")
-                    nome_bloco = linhas[0].strip()
-                    especialidade_bloco = linhas[1].strip() if len(linhas) > 1 else ""
-                    # print(f"🔍 Tentativa {tentativa + 1}: Encontrado -> {nome_bloco} | {especialidade_bloco}")
-                    resultados.append((nome_bloco, especialidade_bloco))
-                    # Se ainda não temos um resultado válido, guarda o primeiro que não é None
-                    if resultado_valido is None and nome_bloco is not None:
-                        resultado_valido = (nome_bloco, especialidade_bloco)
-                else:
-                    # print(f"🔍 Tentativa {tentativa + 1}: Painel não encontrado.")
-                    resultados.append((None, None))
+    for bloco in extrair_grade(driver):
+        if not bloco.get("nome_painel") or not bloco.get("id"):
+            continue
+        entrada = (normalizar_nome(bloco.get("especialidade", "")), bloco["id"])
+        # O nome do painel e o da primeira linha do bloco (o que o find_slot devolve) apontam para o mesmo bloco
+        for nome in {bloco["nome_painel"], bloco.get("profissional") or bloco["nome_painel"]}:
+            indice.setdefault(normalizar_nome(nome), []).append(entrada)
 
-            except Exception as e:
-                print(f"⚠️ Erro na tentativa {tentativa + 1} ({type(e).__name__})")
-                # Se der stale, re-localize o bloco a partir do driver
-                try:
-                    blocos = driver.find_elements(By.CSS_SELECTOR, "td[id^='pf']")
-                    bloco = blocos[index]
-                    print("Re-localizado o bloco.")
-                except Exception as e2:
-                    print(f"Erro ao re-localizar o bloco {type(e2).__name__}")
-                resultados.append((None, None))
-            time.sleep(0.5)  # Pequena pausa entre as tentativas
-
-        # Após 3 tentativas, verifica os resultados coletados
-        # Imprime apenas uma vez com base no primeiro resultado válido (se houver)
-        if resultado_valido:
-            nome_bloco, especialidade_bloco = resultado_valido
-            print(f"🔍 Profissional encontrado -> {nome_bloco} | {especialidade_bloco}")
-
-        # for nome_bloco, especialidade_bloco in resultados:
-        #     # TODO VER COMO IMPRIME SÓ UMA VEZ
-        #     print(f"🔍 Profissional encontrado -> {nome_bloco} | {especialidade_bloco}")
-        #     if nome_bloco is None:
-        #         continue
-            # if nome_bloco.lower() == nome_profissional.lower() and especialidade.lower() in especialidade_bloco.lower():
-            if similar(nome_bloco.lower(),
-                       nome_profissional.lower()) >= 0.75 and especialidade.lower() in especialidade_bloco.lower():
-                print(f"✅ Bloco encontrado com os critérios desejados.\nProfissional selecionado: {nome_profissional}\n"
-                      f"Profissional bloco: {nome_bloco}\nSimilaridade: {similar(nome_bloco.lower(),nome_profissional.lower())}")
-                return bloco
+    print(f"🗂️ Índice de blocos montado com {len(indice)} profissional(is).")
+    return indice
 
-        else:
-            print("⛔ Nenhum profissional com os critérios foi encontrado nesse bloco.")
+
+def localizar_no_indice(indice: dict[str, list[tuple[str, str]]], nome_profissional: str,
+                        especialidade: str) -> Optional[str]:
+    """
+    Retorna o id do bloco do profissional com a especialidade desejada, ou None.
+    """
+    nome = normalizar_nome(nome_profissional)
+    especialidade = normalizar_nome(especialidade)
+
+    for especialidade_bloco, bloco_id in indice.get(nome, []):
+        if especialidade in especialidade_bloco:
+            return bloco_id
+
+    # Nome não bateu exatamente: tolera pequenas diferenças de grafia, como antes (só em memória)
+    for nome_bloco, entradas in indice.items():
+        similaridade = similar(nome_bloco, nome)
+        if similaridade < 0.75:
+            continue
+        for especialidade_bloco, bloco_id in entradas:
+            if especialidade in especialidade_bloco:
+                print(f"✅ Bloco encontrado por similaridade.\nProfissional selecionado: {nome_profissional}\n"
+                      f"Profissional bloco: {nome_bloco}\nSimilaridade: {similaridade}")
+                return bloco_id
 
     return None
 
+
+def buscar_bloco_do_profissional(driver, nome_profissional: str, especialidade: str, indice=None):
+    """
+    Busca o bloco do profissional específico, com a especialidade desejada.
+    Reaproveita `indice` (de indexar_blocos) quando informado; retorna o bloco ou None.
+    """
+    if indice is None:
+        indice = indexar_blocos(driver)
+
+    bloco_id = localizar_no_indice(indice, nome_profissional, especialidade)
+    if not bloco_id:
+        print("⛔ Nenhum profissional com os critérios foi encontrado na grade.")
+        return None
+
+    try:
+        bloco = driver.find_element(By.ID, bloco_id)
+    except NoSuchElementException:
+        # A grade foi redesenhada com outros ids: reindexa uma única vez
+        print("🔄 Bloco não está mais na página. Reindexando a grade...")
+        indice.clear()
+        indice.update(indexar_blocos(driver))
+        bloco_id = localizar_no_indice(indice, nome_profissional, especialidade)
+        if not bloco_id:
+            return None
+        bloco = driver.find_element(By.ID, bloco_id)
+
+    print(f"🔍 Profissional encontrado -> {nome_profissional} | {especialidade} ({bloco_id})")
+    return bloco
+
+
+def aguardar_opcoes_select2(driver, limite: float = LIMITE_ESPERA) -> list:
+    """
+    Aguarda o dropdown do select2 sair do 'searching' e retorna as opções visíveis
+    (lista vazia se estourar o limite).
+    """
+    def opcoes_prontas(d):
+        opcoes = d.find_elements(By.CSS_SELECTOR, "ul.select2-results__options li")
+        visiveis = [op for op in opcoes if op.is_displayed() and op.text.strip()]
+        if visiveis and "searching" not in visiveis[0].text.strip().lower():
+            return visiveis
+        return False
+
+    try:
+        return WebDriverWait(driver, limite, poll_frequency=0.25,
+                             ignored_exceptions=(StaleElementReferenceException,)).until(opcoes_prontas)
+    except TimeoutException:
+        return []
+
+
 def preencher_paciente(driver, wait, cpf, matricula, data_nascimento, celular):
     try:
         print("🟢 Iniciando preenchimento de paciente...")
@@ -103,33 +139,22 @@ def preencher_paciente(driver, wait, cpf, matricula, data_nascimento, celular):
             return False
 
         print("🔸 Aguardando opções visíveis diferentes de 'searching'...")
-        time.sleep(1)
-        max_tentativas = 4
-        for tentativas in range(max_tentativas):
-            opcoes = driver.find_elements(By.CSS_SELECTOR, "ul.select2-results__options li")
-            opcoes_visiveis = [op for op in opcoes if op.is_displayed() and op.text.strip()]
-
-            print(f"🔍 Tentativa {tentativas + 1} — {len(opcoes_visiveis)} opção(ões) visível(is):")
-            for i, op in enumerate(opcoes_visiveis):
-                texto = op.text.strip()
-                # html = op.get_attribute("innerHTML")
-                print(f"  ▶️ [{i}] Texto: {texto}")
-                # print(f"     HTML: {html[:300]}{'...' if len(html) > 300 else ''}")
-
-            if opcoes_visiveis:
-                primeiro_texto = opcoes_visiveis[0].text.strip().lower()
-                if "searching" not in primeiro_texto:
-                    break
-
-            time.sleep(1)
-        else:
+        opcoes_visiveis = aguardar_opcoes_select2(driver, limite=4)
+
+        print(f"🔍 {len(opcoes_visiveis)} opção(ões) visível(is):")
+        for i, op in enumerate(opcoes_visiveis):
+            texto = op.text.strip()
+            # html = op.get_attribute("innerHTML")
+            print(f"  ▶️ [{i}] Texto: {texto}")
+            # print(f"     HTML: {html[:300]}{'...' if len(html) > 300 else ''}")
+
+        if not opcoes_visiveis:
             print("⛔ Nenhuma opção válida apareceu após aguardar.")
             return False
 
         print("🔸 Rebuscando lista final de opções...")
         opcoes = driver.find_elements(By.CSS_SELECTOR, "ul.select2-results__options li")
         opcoes_visiveis = [op for op in opcoes if op.is_displayed() and op.text.strip()]
-        time.sleep(1)
         if not opcoes_visiveis:
             print("⛔ Nenhuma opção visível final encontrada.")
             return False
@@ -165,7 +190,6 @@ def preencher_paciente(driver, wait, cpf, matricula, data_nascimento, celular):
             else:
                 try:
                     # Aguarda até que o input esteja visível
-                    time.sleep(1)
                     input_nascimento = wait.until(EC.visibility_of_element_located((By.ID, "ageNascimento")))
                     if not input_nascimento.get_attribute("value").strip():
                         input_nascimento.clear()
@@ -177,7 +201,6 @@ def preencher_paciente(driver, wait, cpf, matricula, data_nascimento, celular):
         # 📱 Celular
         if celular:
             try:
-                time.sleep(1)
                 input_celular = wait.until(EC.visibility_of_element_located((By.ID, "ageCel1")))
                 if not input_celular.get_attribute("value").strip():
                     input_celular.clear()
@@ -248,7 +271,6 @@ def preencher_paciente(driver, wait, cpf, matricula, data_nascimento, celular):
 # ___________________________________________________________________________________________________________________
         # 🩺 Procedimento
 
-        time.sleep(1)
         max_tentativas = 3
         for tentativa in range(max_tentativas):
             try:
@@ -260,29 +282,16 @@ def preencher_paciente(driver, wait, cpf, matricula, data_nascimento, celular):
                 print("🖱️ Container de Procedimento encontrado. Clicando para abrir dropdown...")
                 # Rola a tela para que o elemento fique visível
                 driver.execute_script("arguments[0].scrollIntoView(true);", procedimento_container)
-                time.sleep(1)  # Pequeno delay para estabilizar a rolagem
                 procedimento_container.click()
 
                 print("🔸 Aguardando opções visíveis diferentes de 'searching'...")
+                opcoes_visiveis = [op.text.strip() for op in aguardar_opcoes_select2(driver, limite=15)]
 
-                for espera in range(10):
-                    opcoes = driver.find_elements(By.CSS_SELECTOR, "ul.select2-results__options li")
-                    opcoes_visiveis = [op.text.strip() for op in opcoes if
-                                       op.is_displayed() and op.text.strip()]
-
-                    print(f"🔍 Tentativa {tentativa + 1} — {len(opcoes_visiveis)} opção(ões) visível(is):")
-                    time.sleep(1)
-
-                    for i, texto in enumerate(opcoes_visiveis):
-                        print(f"  ▶️ [{i}] Texto: {texto}")
+                print(f"🔍 Tentativa {tentativa + 1} — {len(opcoes_visiveis)} opção(ões) visível(is):")
+                for i, texto in enumerate(opcoes_visiveis):
+                    print(f"  ▶️ [{i}] Texto: {texto}")
 
-                    if opcoes_visiveis:
-                        primeiro_texto = opcoes_visiveis[0].lower()
-                        if "searching" not in primeiro_texto:
-                            break
-
-                    time.sleep(0.5)
-                else:
+                if not opcoes_visiveis:
                     print("⛔ Nenhuma opção válida apareceu após aguardar.")
                     return False
 
@@ -306,7 +315,6 @@ def preencher_paciente(driver, wait, cpf, matricula, data_nascimento, celular):
 
                 # Rola a opção desejada para a visualização
                 driver.execute_script("arguments[0].scrollIntoView(true);", opcao_alvo)
-                time.sleep(0.5)  # Aguarda a rolagem se necessário
 
                 texto_final = opcao_alvo.text.strip()
                 opcao_alvo.click()
@@ -410,7 +418,7 @@ def salvar_agendamento(driver, wait):
         return False
 
 
-def confirmar_agendado(driver, wait, nome_paciente, nome_medico, hora, especialidade):
+def confirmar_agendado(driver, wait, nome_paciente, nome_medico, hora, especialidade, indice=None):
         # Verifica na listagem se o agendamento foi realizado
         try:
             checkbox = wait.until(EC.presence_of_element_located((By.ID, "HVazios")))
@@ -418,8 +426,8 @@ def confirmar_agendado(driver, wait, nome_paciente, nome_medico, hora, especiali
 
             # Verifica se o checkbox está marcado
             if checkbox.is_selected():
-                driver.execute_script("arguments[0].click();", checkbox)
-                time.sleep(1)
+                with aguardar_mudanca(driver, "#contQuadro"):
+                    driver.execute_script("arguments[0].click();", checkbox)
                 print("☑️ Checkbox 'Somente horários vazios' desmarcada.")
             else:
                 print("☑️ Checkbox 'Somente horários vazios' já estava desmarcada.")
@@ -428,8 +436,7 @@ def confirmar_agendado(driver, wait, nome_paciente, nome_medico, hora, especiali
             print("⚠️ Checkbox não encontrada.")
             return False
 
-        blocos = driver.find_elements(By.CSS_SELECTOR, "td[id^='pf']")
-        bloco_desejado = buscar_bloco_do_profissional(driver, blocos, nome_medico, especialidade)
+        bloco_desejado = buscar_bloco_do_profissional(driver, nome_medico, especialidade, indice)
 
         if not bloco_desejado:
             print("⛔ Horário desejado com o profissional especificado não encontrado.")
@@ -473,8 +480,8 @@ def cancelar_agendado(driver, wait, nome_paciente, nome_medico, hora, especialid
 
         # Verifica se o checkbox está marcado
         if checkbox.is_selected():
-            driver.execute_script("arguments[0].click();", checkbox)
-            time.sleep(1)
+            with aguardar_mudanca(driver, "#contQuadro"):
+                driver.execute_script("arguments[0].click();", checkbox)
             print("☑️ Checkbox 'Somente horários vazios' desmarcada.")
         else:
             print("☑️ Checkbox 'Somente horários vazios' já estava desmarcada.")
@@ -483,8 +490,7 @@ def cancelar_agendado(driver, wait, nome_paciente, nome_medico, hora, especialid
         print("⚠️ Checkbox não encontrada.")
         return False
 
-    blocos = driver.find_elements(By.CSS_SELECTOR, "td[id^='pf']")
-    bloco_desejado = buscar_bloco_do_profissional(driver, blocos, nome_medico, especialidade)
+    bloco_desejado = buscar_bloco_do_profissional(driver, nome_medico, especialidade)
 
     if not bloco_desejado:
         print("⛔ Horário agendado com o profissional especificado não encontrado.")
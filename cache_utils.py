@@ -0,0 +1,182 @@
+# 🗂 Bibliotecas
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+# 💾 Redis
+from redis_utils import obter_redis, horario_do_slot, FUSO, SCRIPT_LIBERAR
+
+
+# ⏱ Por quanto tempo a grade de uma (especialidade, data) é reaproveitada entre pacientes (segundos)
+CACHE_GRADE_TTL = int(os.getenv("CACHE_GRADE_TTL", "60"))
+# Depois de vencida, por quanto tempo a grade ainda pode ser servida enquanto é relida em segundo plano
+# (stale-while-revalidate). 0 desliga: grade vencida volta a ser lida na hora.
+CACHE_GRADE_OBSOLETO = int(os.getenv("CACHE_GRADE_OBSOLETO", "120"))
+
+
+def chave_grade(especialidade: str, data: str) -> str:
+    return f"grade:{especialidade.lower()}:{data}"
+
+
+async def ler_grades_em_cache(especialidade: str, datas: list[str]) -> dict[str, dict]:
+    """
+    Lê de uma vez (MGET) a grade em cache de cada data e devolve
+    {data: {"horarios": [(hora, medico, consultorio)], "idade": segundos, "obsoleta": bool}}.
+    Datas sem cache ficam de fora do dict; uma lista vazia é um "sem horários" válido.
+    Uma grade obsoleta ainda pode ser usada, mas precisa ser relida (revalidar_grade).
+    """
+    if not datas:
+        return {}
+
+    valores = await obter_redis().mget([chave_grade(especialidade, data) for data in datas])
+    agora = time.time()
+    grades = {}
+    for data, valor in zip(datas, valores):
+        if valor is None:
+            continue
+        try:
+            dados = json.loads(valor)
+            atualizado_em = float(dados["atualizado_em"])
+            fresca_ate = float(dados.get("fresca_ate", atualizado_em + CACHE_GRADE_TTL))
+            grades[data] = {
+                "horarios": [tuple(horario) for horario in dados["horarios"]],
+                "idade": max(0.0, agora - atualizado_em),
+                "obsoleta": agora >= fresca_ate
+            }
+        except (ValueError, KeyError, TypeError):
+            continue
+    return grades
+
+
+async def gravar_grade_em_cache(especialidade: str, data: str, horarios: list[tuple[str, str, str]],
+                                ttl: int = CACHE_GRADE_TTL, retencao: int | None = None):
+    """
+    A grade fica fresca por `ttl` segundos e continua no Redis por mais CACHE_GRADE_OBSOLETO,
+    podendo ser servida como obsoleta enquanto é relida.
+    `retencao` só mantém a chave por mais tempo (ex.: crawler até a próxima passada): a grade continua
+    ficando obsoleta depois de `ttl` e é relida na primeira vez que for servida assim.
+    """
+    agora = time.time()
+    dados = {
+        "horarios": [list(horario) for horario in horarios],
+        "atualizado_em": agora,
+        "fresca_ate": agora + ttl
+    }
+    await obter_redis().set(chave_grade(especialidade, data), json.dumps(dados, ensure_ascii=False),
+                            ex=max(ttl + CACHE_GRADE_OBSOLETO, retencao or 0))
+
+
+# 🗓️ Grade inteira de uma data (todas as especialidades), guardada só para quem espera a leitura de outro processo
+def chave_grade_bruta(data: str) -> str:
+    return f"grade_bruta:{data}"
+
+
+async def gravar_grade_bruta(data: str, grade: list[dict], ttl: int = CACHE_GRADE_TTL):
+    dados = {"grade": grade, "atualizado_em": time.time()}
+    await obter_redis().set(chave_grade_bruta(data), json.dumps(dados, ensure_ascii=False), ex=ttl)
+
+
+async def ler_grade_bruta(data: str, desde: float) -> list[dict] | None:
+    """
+    Grade inteira de `data`, só se foi gravada a partir de `desde` (time.time()); senão None.
+    """
+    valor = await obter_redis().get(chave_grade_bruta(data))
+    if valor is None:
+        return None
+    try:
+        dados = json.loads(valor)
+        if float(dados["atualizado_em"]) < desde:
+            return None
+        return dados["grade"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+# 🚦 Uma leitura por (especialidade, data) entre processos: quem não pega a trava espera a grade no cache.
+# Com especialidade=None, a trava é da grade inteira da data.
+TTL_TRAVA_LEITURA = int(os.getenv("TTL_TRAVA_LEITURA", "60"))
+
+
+def chave_trava_leitura(especialidade: str | None, data: str) -> str:
+    if especialidade is None:
+        return f"lendo:{chave_grade_bruta(data)}"
+    return f"lendo:{chave_grade(especialidade, data)}"
+
+
+async def travar_leitura(especialidade: str | None, data: str, dono: str) -> bool:
+    """
+    SET NX com TTL: a trava some sozinha se o processo que lia morrer no meio.
+    """
+    return bool(await obter_redis().set(chave_trava_leitura(especialidade, data), dono, nx=True,
+                                        ex=TTL_TRAVA_LEITURA))
+
+
+async def liberar_leitura(especialidade: str | None, data: str, dono: str):
+    await obter_redis().eval(SCRIPT_LIBERAR, 1, chave_trava_leitura(especialidade, data), dono)
+
+
+async def leitura_em_andamento(especialidade: str | None, data: str) -> bool:
+    return bool(await obter_redis().exists(chave_trava_leitura(especialidade, data)))
+
+
+# 📈 Visão materializada por especialidade: ZSET com todos os horários conhecidos, pontuados pelo instante
+# do horário. O primeiro elemento a partir de "agora" é o horário disponível mais cedo.
+def chave_vista(especialidade: str) -> str:
+    return f"proximos:{especialidade.lower()}"
+
+
+def chave_vista_datas(especialidade: str) -> str:
+    # Hash data -> até quando a leitura do crawler vale: diz quais datas a visão cobre, mesmo as sem horário
+    return f"proximos_datas:{especialidade.lower()}"
+
+
+def inicio_do_dia(data: str) -> datetime:
+    return datetime.strptime(data, "%d/%m/%Y").replace(tzinfo=FUSO)
+
+
+async def atualizar_vista(especialidade: str, data: str, horarios: list[tuple[str, str, str]], ttl: int):
+    """
+    Substitui na visão os horários de `data` pelos recém-lidos e descarta os que já passaram.
+    """
+    chave = chave_vista(especialidade)
+    inicio = inicio_do_dia(data)
+    fim = inicio + timedelta(days=1)
+
+    membros = {}
+    for hora, medico, consultorio in horarios:
+        try:
+            pontuacao = horario_do_slot(data, hora).timestamp()
+        except ValueError:
+            continue
+        membros[json.dumps([data, hora, medico, consultorio], ensure_ascii=False)] = pontuacao
+
+    pipe = obter_redis().pipeline(transaction=True)
+    pipe.zremrangebyscore(chave, inicio.timestamp(), f"({fim.timestamp()}")
+    pipe.zremrangebyscore(chave, "-inf", f"({time.time()}")
+    if membros:
+        pipe.zadd(chave, membros)
+    pipe.expire(chave, ttl)
+    pipe.hset(chave_vista_datas(especialidade), data, time.time() + ttl)
+    pipe.expire(chave_vista_datas(especialidade), ttl)
+    await pipe.execute()
+
+
+async def ler_vista(especialidade: str, inicio: datetime, fim: datetime
+                    ) -> tuple[list[tuple[str, str, str, str]], set[str]] | None:
+    """
+    Horários da visão entre `inicio` e `fim`, em ordem cronológica: [(data, hora, medico, consultorio)],
+    junto com as datas que a visão cobre (lidas pelo crawler e ainda válidas, com ou sem horários).
+    Retorna None se a visão não existe (crawler desligado ou parado há mais que o TTL).
+    """
+    redis = obter_redis()
+    pipe = redis.pipeline(transaction=False)
+    pipe.hgetall(chave_vista_datas(especialidade))
+    pipe.zrangebyscore(chave_vista(especialidade), inicio.timestamp(), f"({fim.timestamp()}")
+    datas, membros = await pipe.execute()
+    if not datas:
+        return None
+
+    agora = time.time()
+    cobertas = {data for data, valida_ate in datas.items() if float(valida_ate) > agora}
+    return [tuple(json.loads(membro)) for membro in membros], cobertas
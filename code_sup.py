@@ -4,17 +4,34 @@ from contextlib import asynccontextmanager
 import os
 import unicodedata
 import re
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from difflib import SequenceMatcher
 
 # 🧭 Navegador
-from driver_utils import fechar_driver
+from driver_utils import fechar_driver, driver_pool
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
-    # inicialização opcional aqui
+    # Import local: redis_utils depende deste módulo (normalizar_nome)
+    from redis_utils import iniciar_redis, fechar_redis
+    from crawler import iniciar_crawler, parar_crawler
+
+    # 💾 Pool de conexões assíncronas do Redis, compartilhado por todos os requests
+    await iniciar_redis()
+
+    # 🔥 Sobe o navegador, faz login e estaciona na agenda antes de aceitar requests
+    if os.getenv("AQUECER_NAVEGADOR", "true").lower() != "false":
+        await driver_pool.aquecer()
+    else:
+        print("⏭️ Aquecimento do navegador desativado (AQUECER_NAVEGADOR=false).")
+        driver_pool.pronto = True
+
+    # 🕷️ Mantém a grade das especialidades mais buscadas sempre quente no Redis
+    iniciar_crawler()
     yield
+    await parar_crawler()
+    await fechar_redis()
     if os.getenv("ENV") == "local":
         print("🛑 Encerrando driver do Selenium...")
         try:
@@ -25,11 +42,24 @@ async def lifespan(_: FastAPI):
         print("⚠️ Ambiente de produção — mantendo driver em execução.")
 
 
+# HH:MM de 00:00 a 23:59
+PADRAO_HORA = r"^([01]\d|2[0-3]):[0-5]\d$"
+
+# Cada horário devolvido fica reservado por TTL_RESERVA: um pedido não pode segurar a agenda inteira
+QUANTIDADE_MAXIMA = int(os.getenv("QUANTIDADE_MAXIMA", "5"))
+
+
 class RequisicaoHorario(BaseModel):
     solicitante_id: str
     especialidade: str
     data: str | None = None
     minutos_ate_disponivel: int | None = 0
+    # Quantos horários devolver, do mais cedo em diante (0 = todos da janela, sem reservar)
+    quantidade: int = Field(1, ge=0, le=QUANTIDADE_MAXIMA)
+    # Filtros opcionais: faixa de horário (HH:MM) e profissional
+    hora_minima: str | None = Field(None, pattern=PADRAO_HORA)
+    hora_maxima: str | None = Field(None, pattern=PADRAO_HORA)
+    profissional: str | None = None
 
 class ConfirmacaoAgendamento(BaseModel):
     matricula: str | None = None
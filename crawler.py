@@ -0,0 +1,137 @@
+# 🗂 Bibliotecas
+from datetime import datetime, timedelta
+import asyncio
+import logging
+import os
+import time
+from uuid import uuid4
+
+# 🗄️ Cache de disponibilidade
+from cache_utils import gravar_grade_em_cache, atualizar_vista, CACHE_GRADE_TTL
+
+# 🗓️ Grade de horários
+from grade_utils import horarios_da_especialidade
+
+# 🔎 Busca de horários
+from find_slot import grade_do_dia_compartilhada
+
+# 💾 Redis
+from redis_utils import obter_redis, FUSO, SCRIPT_LIBERAR, SCRIPT_RENOVAR
+
+# 🧭 Navegador
+from driver_utils import PRIORIDADE_VARREDURA
+
+
+logger = logging.getLogger(__name__)
+
+# Especialidades pré-carregadas (separadas por vírgula). Sem nenhuma, o crawler não sobe.
+CRAWLER_ESPECIALIDADES = [e.strip() for e in os.getenv("CRAWLER_ESPECIALIDADES", "").split(",") if e.strip()]
+CRAWLER_DIAS = int(os.getenv("CRAWLER_DIAS", "10"))
+# Intervalo entre o início de duas passadas completas (segundos)
+CRAWLER_INTERVALO = int(os.getenv("CRAWLER_INTERVALO", "300"))
+# O que o crawler grava precisa durar até a passada seguinte, com folga
+CRAWLER_TTL = max(CACHE_GRADE_TTL, 3 * CRAWLER_INTERVALO)
+
+# 👑 Só uma réplica varre por vez: a que segura a trava de líder, renovada a cada data lida.
+# Se ela cair, outra assume quando a trava expirar.
+CHAVE_LIDER = "crawler:lider"
+TTL_LIDER = 2 * CRAWLER_INTERVALO
+_id_instancia = uuid4().hex
+
+_tarefa: asyncio.Task | None = None
+estado = {
+    "passadas": 0,
+    "ultima_passada_em": None,
+    "ultima_duracao_s": None,
+    "datas_com_erro": 0,
+}
+
+
+async def assumir_lideranca() -> bool:
+    """
+    Pega a trava de líder, ou renova se já é desta réplica. Retorna False se outra réplica está varrendo.
+    """
+    redis = obter_redis()
+    if await redis.set(CHAVE_LIDER, _id_instancia, nx=True, ex=TTL_LIDER):
+        print("👑 Crawler: esta réplica assumiu a varredura.")
+        return True
+    return bool(await redis.eval(SCRIPT_RENOVAR, 1, CHAVE_LIDER, _id_instancia, TTL_LIDER))
+
+
+async def rodar_uma_passada():
+    """
+    Lê os próximos CRAWLER_DIAS dias uma vez e, de cada grade, alimenta o cache e a visão
+    de todas as especialidades configuradas.
+    A leitura é a compartilhada do /find_slot: um paciente pedindo a mesma data espera a mesma leitura.
+    """
+    inicio = time.monotonic()
+    hoje = datetime.now(FUSO)
+
+    for dias_adiante in range(CRAWLER_DIAS):
+        data_atual = hoje + timedelta(days=dias_adiante)
+        data_str = data_atual.strftime("%d/%m/%Y")
+
+        if not await assumir_lideranca():
+            print("⏭️ Crawler: outra réplica está varrendo. Pulando a passada.")
+            return
+
+        try:
+            grade = await grade_do_dia_compartilhada(data_atual, prioridade=PRIORIDADE_VARREDURA)
+        except Exception as e:
+            logger.warning(f"⚠️ Crawler: erro ao ler {data_str} ({type(e).__name__})")
+            grade = None
+
+        if grade is None:
+            estado["datas_com_erro"] += 1
+            continue
+
+        # Uma grade lida serve a todas as especialidades. No cache ela segue o prazo normal de frescor
+        # (e é relida sob demanda quando vencer); só a chave dura até a próxima passada.
+        for especialidade in CRAWLER_ESPECIALIDADES:
+            horarios = horarios_da_especialidade(grade, especialidade)
+            await gravar_grade_em_cache(especialidade, data_str, horarios, retencao=CRAWLER_TTL)
+            await atualizar_vista(especialidade, data_str, horarios, ttl=CRAWLER_TTL)
+
+    estado["passadas"] += 1
+    estado["ultima_passada_em"] = datetime.now(FUSO).isoformat(timespec="seconds")
+    estado["ultima_duracao_s"] = round(time.monotonic() - inicio, 1)
+    print(f"🕷️ Crawler: passada concluída em {estado['ultima_duracao_s']}s.")
+
+
+async def _laco():
+    while True:
+        inicio = time.monotonic()
+        try:
+            await rodar_uma_passada()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ Crawler: passada interrompida ({type(e).__name__})")
+        await asyncio.sleep(max(0.0, CRAWLER_INTERVALO - (time.monotonic() - inicio)))
+
+
+def iniciar_crawler():
+    global _tarefa
+    if not CRAWLER_ESPECIALIDADES:
+        print("⏭️ Crawler desativado (CRAWLER_ESPECIALIDADES vazio).")
+        return
+    print(f"🕷️ Crawler iniciado para {', '.join(CRAWLER_ESPECIALIDADES)} ({CRAWLER_DIAS} dias).")
+    _tarefa = asyncio.create_task(_laco())
+
+
+async def parar_crawler():
+    global _tarefa
+    if _tarefa is None:
+        return
+    _tarefa.cancel()
+    try:
+        await _tarefa
+    except asyncio.CancelledError:
+        pass
+    _tarefa = None
+
+    # Libera a liderança já, para outra réplica não esperar a trava expirar
+    try:
+        await obter_redis().eval(SCRIPT_LIBERAR, 1, CHAVE_LIDER, _id_instancia)
+    except Exception as e:
+        logger.warning(f"⚠️ Crawler: não foi possível liberar a liderança ({type(e).__name__})")
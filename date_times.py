@@ -3,48 +3,161 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
 from datetime import datetime
-import time
+import logging
+import re
 
+# ⏱ Esperas
+from wait_utils import aguardar_mudanca, aguardar_ajax_ocioso
+
+
+logger = logging.getLogger(__name__)
 
 abreviacoes_meses = {
     1: "JAN", 2: "FEV", 3: "MAR", 4: "ABR", 5: "MAI", 6: "JUN",
     7: "JUL", 8: "AGO", 9: "SET", 10: "OUT", 11: "NOV", 12: "DEZ"
 }
-
-
-def extrair_horarios_de_bloco(bloco, especialidade: str) -> list[str]:
-    horarios = []
-
-    try:
-        painel = bloco.find_elements(By.CSS_SELECTOR, ".panel-title")
-        if not painel:
-            print("⚠️ Bloco sem .panel-title encontrado, ignorando...")
-            return []
-
-        nome_especialidade = painel[0].text.strip().lower()
-
-        linhas = nome_especialidade.split("\n")
-        nome = linhas[0] if linhas else ""
-        especialidade_prof = linhas[1] if len(linhas) > 1 else ""
-
-        print(f"🔍 Profissional detectado: {nome} / {especialidade_prof}")
-        # print(especialidade_prof)
-
-        if especialidade.lower() in especialidade_prof:
-            botoes = bloco.find_elements(By.CSS_SELECTOR, ".btn-info")
-            for botao in botoes:
-                try:
-                    texto = botao.text.strip()
-                    if texto:
-                        print(texto)
-                        horarios.append(texto)
-                except Exception as e:
-                    print(f"⚠️ Botão obsoleto ignorado ({type(e).__name__})")
-
-    except Exception as e:
-        print(f"⚠️ Erro ao processar bloco ({type(e).__name__})")
-
-    return horarios
+meses_por_abreviacao = {abrev: mes for mes, abrev in abreviacoes_meses.items()}
+
+# 🧠 Mês exibido no calendário de cada sessão do navegador: session_id -> (mes, ano)
+_mes_exibido: dict[str, tuple[int, int]] = {}
+
+
+def esquecer_mes(driver):
+    # Chamado quando a página é recarregada e o calendário volta ao estado inicial
+    _mes_exibido.pop(driver.session_id, None)
+
+
+def ler_mes_exibido(driver) -> tuple[int, int] | None:
+    ths = driver.find_elements(By.CSS_SELECTOR, "#tblCalendario th")
+    mes_atual_th = next((th for th in ths if " - " in th.text), None)
+    if not mes_atual_th:
+        return None
+
+    abreviacao, _, ano = mes_atual_th.text.strip().upper().partition(" - ")  # ex: 'MAR - 2025'
+    mes = meses_por_abreviacao.get(abreviacao.strip())
+    if not mes or not ano.strip().isdigit():
+        return None
+    return mes, int(ano)
+
+
+def somar_meses(mes: int, ano: int, quantidade: int) -> tuple[int, int]:
+    indice = ano * 12 + (mes - 1) + quantidade
+    return indice % 12 + 1, indice // 12
+
+
+def _botao_mes(driver, lado: str):
+    # lado: "right" (próximo mês) ou "left" (mês anterior)
+    for botao in driver.find_elements(By.CSS_SELECTOR, f"table#tblCalendario th.hand.text-{lado}"):
+        onclick = botao.get_attribute("onclick")
+        if onclick and "changeMonth" in onclick:
+            return botao, onclick
+    return None, None
+
+
+# Formatos de argumento aceitos pelo changeMonth: (regex, lê (mes, ano), reescreve com (mes, ano))
+_FORMATOS_CHANGE_MONTH = [
+    (r"(\d{1,2})/(\d{1,2})/(\d{4})", lambda g: (int(g[1]), int(g[2])),
+     lambda g, mes, ano: f"{g[0]}/{mes:02d}/{ano}"),
+    (r"(\d{4})-(\d{1,2})-(\d{1,2})", lambda g: (int(g[1]), int(g[0])),
+     lambda g, mes, ano: f"{ano}-{mes:02d}-{g[2]}"),
+    (r"(\d{1,2})/(\d{4})", lambda g: (int(g[0]), int(g[1])),
+     lambda g, mes, ano: f"{mes:02d}/{ano}"),
+    (r"(\d{1,2})\s*,\s*(\d{4})", lambda g: (int(g[0]), int(g[1])),
+     lambda g, mes, ano: f"{mes}, {ano}"),
+    (r"(\d{4})\s*,\s*(\d{1,2})", lambda g: (int(g[1]), int(g[0])),
+     lambda g, mes, ano: f"{ano}, {mes}"),
+]
+
+
+def chamada_para_mes(onclick: str, proximo: tuple[int, int], alvo: tuple[int, int]) -> str | None:
+    """
+    Reescreve o changeMonth(...) do botão de próximo mês para apontar direto para `alvo`.
+    O formato dos argumentos é deduzido comparando-os com `proximo` (o mês seguinte ao exibido),
+    o que também detecta meses contados a partir de zero. Retorna None se não reconhecer o formato.
+    """
+    chamada = re.search(r"changeMonth\s*\((.*)\)", onclick)
+    if not chamada:
+        return None
+    argumentos = chamada.group(1)
+
+    for padrao, ler, escrever in _FORMATOS_CHANGE_MONTH:
+        achado = re.search(padrao, argumentos)
+        if not achado:
+            continue
+        grupos = achado.groups()
+        mes_arg, ano_arg = ler(grupos)
+        deslocamento = mes_arg - proximo[0]
+        if ano_arg != proximo[1] or deslocamento not in (0, -1):
+            continue
+
+        novo = escrever(grupos, alvo[0] + deslocamento, alvo[1])
+        novos_argumentos = argumentos[:achado.start()] + novo + argumentos[achado.end():]
+        return onclick[:chamada.start(1)] + novos_argumentos + onclick[chamada.end(1):]
+
+    return None
+
+
+def ir_para_mes(driver, alvo: tuple[int, int]) -> bool:
+    sessao = driver.session_id
+    atual = _mes_exibido.get(sessao) or ler_mes_exibido(driver)
+    if atual is None:
+        print("⚠️ Não foi possível identificar o mês atual do calendário.")
+        return False
+    _mes_exibido[sessao] = atual
+
+    if atual == alvo:
+        return True
+
+    texto_alvo = f"{abreviacoes_meses[alvo[0]]} - {alvo[1]}"
+
+    # 🚀 Uma única chamada ao changeMonth da página, direto no mês desejado
+    _, onclick = _botao_mes(driver, "right")
+    chamada = chamada_para_mes(onclick, somar_meses(*atual, 1), alvo) if onclick else None
+    if chamada:
+        try:
+            with aguardar_mudanca(driver, "#tblCalendario"):
+                driver.execute_script(chamada)
+            if ler_mes_exibido(driver) == alvo:
+                _mes_exibido[sessao] = alvo
+                print(f"🚀 Calendário levado direto para {texto_alvo}.")
+                return True
+        except Exception as e:
+            logger.warning(f"⚠️ Salto direto para {texto_alvo} falhou ({type(e).__name__})")
+
+        # O salto não deu certo: relê o mês antes de cair para os cliques
+        esquecer_mes(driver)
+        atual = ler_mes_exibido(driver)
+        if atual is None:
+            print("⚠️ Não foi possível identificar o mês atual do calendário.")
+            return False
+        _mes_exibido[sessao] = atual
+
+    # ↪️ Fallback: clica nas setas, contando os meses em memória
+    diferenca = (alvo[1] - atual[1]) * 12 + (alvo[0] - atual[0])
+    if abs(diferenca) > 12:  # tenta no máximo 12 meses de distância
+        print(f"⚠️ {texto_alvo} está a mais de 12 meses do calendário.")
+        return False
+
+    lado, passo = ("right", 1) if diferenca > 0 else ("left", -1)
+    for _ in range(abs(diferenca)):
+        botao, _ = _botao_mes(driver, lado)
+        if not botao:
+            print("⚠️ Botão de mudança de mês não encontrado.")
+            esquecer_mes(driver)
+            return False
+        with aguardar_mudanca(driver, "#tblCalendario"):
+            driver.execute_script("arguments[0].click();", botao)
+        atual = somar_meses(*atual, passo)
+
+    # Um clique perdido (ou uma espera estourada) não pode deixar a memória adiantada: confere o cabeçalho
+    lido = ler_mes_exibido(driver)
+    if lido != alvo:
+        print(f"⚠️ Calendário em {lido} depois das setas, esperado {texto_alvo}.")
+        esquecer_mes(driver)
+        return False
+    _mes_exibido[sessao] = alvo
+
+    return True
 
 
 def navegar_para_data(driver, wait, target_date: datetime, first, disp) -> bool:
@@ -55,75 +168,57 @@ def navegar_para_data(driver, wait, target_date: datetime, first, disp) -> bool:
     try:
         wait.until(EC.presence_of_element_located((By.ID, "tblCalendario")))
 
-        for _ in range(12):  # tenta no máximo 12 meses à frente
-            # Lê o mês atual exibido no calendário
-            try:
-                ths = driver.find_elements(By.CSS_SELECTOR, "#tblCalendario th")
-                mes_atual_th = next((th for th in ths if " - " in th.text), None)
-                if not mes_atual_th:
-                    print("⚠️ Não foi possível identificar o mês atual do calendário.")
+        try:
+            if not ir_para_mes(driver, (target_date.month, target_date.year)):
+                return False
+        except Exception as e_mes:
+            print(f"⚠️ Erro ao comparar/avançar mês: {e_mes}")
+            esquecer_mes(driver)
+            return False
+
+        id_data = target_date.strftime("%d/%m/%Y")
+        # Agora tenta clicar na célula da data desejada
+        try:
+            data_element = wait.until(EC.element_to_be_clickable((By.ID, id_data)))
+            driver.execute_script("arguments[0].scrollIntoView(true);", data_element)
+            with aguardar_mudanca(driver, "#contQuadro"):
+                data_element.click()
+            print(f"📌 Data {id_data} clicada com sucesso.")
+
+            # ✅ Depois do clique na data: marca/desmarca checkbox
+            if first:
+                aguardar_ajax_ocioso(driver)
+
+            if disp:
+                try:
+                    checkbox = wait.until(EC.presence_of_element_located((By.ID, "HVazios")))
+                    driver.execute_script("arguments[0].scrollIntoView(true);", checkbox)
+                    with aguardar_mudanca(driver, "#contQuadro"):
+                        driver.execute_script("arguments[0].click();", checkbox)
+                    # Verifica se o checkbox já está selecionado
+                    if checkbox.is_selected():
+                        print("✅ Checkbox 'Somente horários vazios' já está marcado.")
+                    else:
+                        # Se não estiver marcado, clica no checkbox para marcá-lo
+                        with aguardar_mudanca(driver, "#contQuadro"):
+                            driver.execute_script("arguments[0].click();", checkbox)
+                        print("☑️ Checkbox 'Somente horários vazios' foi marcada.")
+
+                except TimeoutException:
+                    print("⚠️ Checkbox não encontrada após clicar na data.")
                     return False
 
-                mes_atual_texto = mes_atual_th.text.strip().upper()  # ex: 'MAR - 2025'
-                mes_desejado_texto = f"{abreviacoes_meses[target_date.month]} - {target_date.year}"
-
-                if mes_atual_texto == mes_desejado_texto:
-                    id_data = target_date.strftime("%d/%m/%Y")
-                    # Agora tenta clicar na célula da data desejada
-                    try:
-                        data_element = wait.until(EC.element_to_be_clickable((By.ID, id_data)))
-                        driver.execute_script("arguments[0].scrollIntoView(true);", data_element)
-                        data_element.click()
-                        print(f"📌 Data {id_data} clicada com sucesso.")
-                        time.sleep(1.5)
-
-                        # ✅ Depois do clique na data: marca/desmarca checkbox
-                        if first:
-                            time.sleep(1.5)
-
-                        if disp:
-                            try:
-                                checkbox = wait.until(EC.presence_of_element_located((By.ID, "HVazios")))
-                                driver.execute_script("arguments[0].scrollIntoView(true);", checkbox)
-                                driver.execute_script("arguments[0].click();", checkbox)
-                                time.sleep(1)
-                                # Verifica se o checkbox já está selecionado
-                                if checkbox.is_selected():
-                                    print("✅ Checkbox 'Somente horários vazios' já está marcado.")
-                                else:
-                                    # Se não estiver marcado, clica no checkbox para marcá-lo
-                                    driver.execute_script("arguments[0].click();", checkbox)
-                                    time.sleep(1)  # Pequena espera para garantir que o clique foi processado
-                                    print("☑️ Checkbox 'Somente horários vazios' foi marcada.")
-
-                            except TimeoutException:
-                                print("⚠️ Checkbox não encontrada após clicar na data.")
-                                return False
-
-                        else:
-                            print("Não há necessidade de clicar na checkbox.")
-
-                        return True
-                    except Exception as e_data:
-                        print(f"⚠️ Falha ao clicar na data {id_data}: {e_data}")
-                        return False
-                else:
-                    # Mês ainda não é o certo: avança
-                    botoes_direita = driver.find_elements(By.CSS_SELECTOR,
-                                                          "table#tblCalendario th.hand.text-right")
-                    for botao in botoes_direita:
-                        if botao.get_attribute("onclick") and "changeMonth" in botao.get_attribute("onclick"):
-                            driver.execute_script("arguments[0].click();", botao)
-                            time.sleep(1.5)
-                            break
-                    else:
-                        print("⚠️ Botão de próximo mês não encontrado.")
-                        return False
+            else:
+                print("Não há necessidade de clicar na checkbox.")
 
-            except Exception as e_mes:
-                print(f"⚠️ Erro ao comparar/avançar mês: {e_mes}")
-                return False
+            return True
+        except Exception as e_data:
+            print(f"⚠️ Falha ao clicar na data {id_data}: {e_data}")
+            # A página pode ter recarregado ou mudado de mês: a próxima navegação relê o cabeçalho
+            esquecer_mes(driver)
+            return False
 
     except Exception as e_data2:
         print(f"⚠️ Erro geral ao navegar até a data {target_date.strftime('%d/%m/%Y')}: {e_data2}")
+        esquecer_mes(driver)
     return False
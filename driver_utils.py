@@ -3,72 +3,453 @@ from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.webdriver import WebDriver
 from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.support.wait import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.common.by import By
+from selenium.common.exceptions import TimeoutException
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
 import os
+import time
+import heapq
 import asyncio
+import itertools
 import logging
 
+# 🔐 Sessão e login
+from auth_utils import sessao_ja_logada, fazer_login
+
+# ⚡ Leitura via HTTP
+from http_utils import atualizar_cookies
+
+# 📆 Horários e datas
+from date_times import esquecer_mes
+
 
 # 📉 Reduz o nível de log da biblioteca selenium
 logging.getLogger("selenium").setLevel(logging.WARNING)
-
-_driver: WebDriver | None = None
-driver_lock = asyncio.Lock()
+logger = logging.getLogger(__name__)
 
 # Obtém o diretório do perfil do Chrome a partir da variável CHROME_PROFILE_DIR
 CHROME_PROFILE = os.getenv("CHROME_PROFILE_DIR", "./chrome_profile_api")
 
+# Quantidade de sessões do Chrome mantidas no pool
+DRIVER_POOL_SIZE = max(1, int(os.getenv("DRIVER_POOL_SIZE", "1")))
+
+URL_AGENDA = "https://amor-saude.feegow.com/pre-v7.6/?P=AgendaMultipla&Pers=1"
+
+# 🚦 Classes de prioridade do pool (menor = mais urgente)
+PRIORIDADE_AGENDAMENTO = 0  # make_appointment: caminho da receita
+PRIORIDADE_CONSULTA = 1     # leitura de um dia pedida por um paciente (find_slot)
+PRIORIDADE_VARREDURA = 2    # crawler e releituras em segundo plano
+NOMES_PRIORIDADE = {
+    PRIORIDADE_AGENDAMENTO: "agendamento",
+    PRIORIDADE_CONSULTA: "consulta",
+    PRIORIDADE_VARREDURA: "varredura",
+}
+
+# Sessões que leituras nunca ocupam, para um agendamento não esperar uma leitura terminar.
+# Com uma sessão só não dá para reservar: o agendamento apenas fura a fila.
+DRIVER_RESERVA_AGENDAMENTO = int(os.getenv("DRIVER_RESERVA_AGENDAMENTO", "1" if DRIVER_POOL_SIZE > 1 else "0"))
+
+# Pedido de sessão da leitura compartilhada que roda na tarefa atual ({"prioridade", "futuro", "dependentes"}).
+# Quem passa a esperar pela leitura pode torná-lo mais urgente enquanto ele ainda está na fila (promover_pedido).
+pedido_compartilhado: ContextVar[dict | None] = ContextVar("pedido_compartilhado", default=None)
+
+# Sessões (session_id) deixadas num estado desconhecido — modal aberto, página de erro, data que não abriu.
+# A próxima leitura não reaproveita a página delas: recarrega a agenda antes.
+_sessoes_sujas: set[str] = set()
+
+
+def perfil_da_sessao(indice: int) -> str:
+    # A primeira sessão reaproveita o perfil original; as demais ganham um diretório próprio
+    if indice == 0:
+        return CHROME_PROFILE
+    return f"{CHROME_PROFILE}_{indice}"
+
+
+# 🧠 Inicializa um navegador com perfil persistente
+def criar_driver(perfil: str = CHROME_PROFILE) -> WebDriver:
+    # Obtém a URL remota do Selenium, se definida
+    remote_url = os.getenv("SELENIUM_REMOTE_URL") or False
+
+    # Se estivermos em ambiente local e NÃO utilizando Selenium remoto, verifica o bloqueio do perfil
+    if os.getenv("ENV") == "local" and not remote_url:
+        lock_path = os.path.join(perfil, "SingletonLock")
+        if os.path.exists(lock_path):
+            raise RuntimeError(f"⚠️ Perfil do Chrome '{perfil}' está em uso. Finalize o container anterior.")
+
+    options = Options()
+    # Só adiciona o user-data-dir se NÃO estivermos usando o driver remoto
+    if not remote_url:
+        options.add_argument(f"user-data-dir={perfil}")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    # Ativa o modo headless quando NÃO estiver em ambiente local (ou seja, quando rodando via API/Render)
+    if os.getenv("ENV") != "local":
+        options.add_argument("--headless=new")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-software-rasterizer")
+    options.add_argument("--disable-extensions")
+    options.add_argument("--disable-infobars")
+    options.add_argument("--disable-features=VizDisplayCompositor")
+    options.add_argument("--log-level=3")
+    options.add_argument("--silent")
+
+    if remote_url:
+        # Conecta ao Selenium remoto (por exemplo, container Selenium)
+        driver = webdriver.Remote(
+            command_executor=remote_url,
+            options=options
+        )
+    else:
+        # Caso contrário, utiliza o driver local (Chrome instalado no container)
+        service = Service(log_path=os.devnull)
+        driver = webdriver.Chrome(service=service, options=options)
+
+    driver.set_window_size(1920, 1080)
+    driver.set_page_load_timeout(30)
+    return driver
+
+
+def driver_saudavel(driver: WebDriver) -> bool:
+    # Um comando barato ao chromedriver basta para saber se a sessão ainda responde
+    try:
+        _ = driver.window_handles
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ Sessão do navegador não respondeu ({type(e).__name__})")
+        return False
+
+
+def preparar_sessao(driver, wait=None) -> bool:
+    """
+    Abre a AgendaMultipla e faz login se necessário.
+    Retorna True se foi preciso logar (primeiro acesso da sessão).
+    """
+    wait = wait or WebDriverWait(driver, 20)
+    driver.get(URL_AGENDA)
+    esquecer_mes(driver)
+
+    if not sessao_ja_logada(driver):
+        print("🔐 Sessão não ativa. Realizando login...")
+        fazer_login(driver, wait)
+        _sessoes_sujas.discard(driver.session_id)
+        marcar_pronto()
+        return True
+
+    print("🔓 Sessão já autenticada.")
+    _sessoes_sujas.discard(driver.session_id)
+    marcar_pronto()
+    return False
+
+
+def marcar_sessao_suja(driver):
+    # Chamado quando uma leitura ou um agendamento falha no meio: a página pode ter ficado em qualquer estado
+    if driver is not None and driver.session_id not in _sessoes_sujas:
+        print("🧹 Sessão do navegador marcada para recarregar a agenda no próximo uso.")
+        _sessoes_sujas.add(driver.session_id)
+
+
+def marcar_pronto():
+    # Se o aquecimento falhou no boot, a primeira sessão que logar sob demanda deixa o pool pronto
+    if not driver_pool.pronto:
+        print("✅ Sessão do navegador logada. Pool pronto.")
+        driver_pool.pronto = True
+
+
+def promover_pedido(pedido: dict, prioridade: int):
+    """
+    Um interessado mais urgente passou a esperar pela leitura compartilhada: o pedido de sessão dela
+    (e das leituras compartilhadas de que ela depende) sobe para a prioridade dele, mesmo já estando na fila.
+    """
+    if prioridade >= pedido["prioridade"]:
+        return
+    pedido["prioridade"] = prioridade
+    if pedido["futuro"] is not None:
+        driver_pool.promover(pedido["futuro"], prioridade)
+    for dependente in pedido["dependentes"]:
+        promover_pedido(dependente, prioridade)
+
+
+def garantir_agenda(driver, wait=None) -> bool:
+    """
+    Reaproveita a AgendaMultipla já aberta e logada na sessão; só recarrega quando preciso
+    (outra página, login pedido ou sessão marcada como suja).
+    Retorna True se foi preciso logar.
+    """
+    if driver.session_id in _sessoes_sujas:
+        print("🧹 Recarregando a agenda de uma sessão que falhou no último uso...")
+        return preparar_sessao(driver, wait)
+
+    try:
+        if "AgendaMultipla" in driver.current_url and not driver.find_elements(By.ID, "User"):
+            marcar_pronto()
+            return False
+    except Exception as e:
+        logger.warning(f"⚠️ Não foi possível verificar a página atual ({type(e).__name__})")
+    return preparar_sessao(driver, wait)
+
+
+def aquecer_sessao(driver):
+    # Deixa a sessão logada e parada na agenda, com o calendário carregado
+    preparar_sessao(driver)
+    try:
+        WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.ID, "tblCalendario")))
+    except TimeoutException:
+        logger.warning("⚠️ Calendário não carregou durante o aquecimento.")
+        return False
+
+    # A sessão HTTP de leitura reaproveita a autenticação do navegador
+    atualizar_cookies(extrair_cookies_selenium(driver))
+    return True
+
+
+class SessaoNavegador:
+    """
+    Uma sessão do Chrome do pool, com perfil próprio e uma thread dedicada.
+    Todo comando do Selenium dessa sessão roda nessa thread, fora do event loop.
+    """
+
+    def __init__(self, indice: int):
+        self.indice = indice
+        self.perfil = perfil_da_sessao(indice)
+        self.driver: WebDriver | None = None
+        self.usos = 0
+        self.classe = PRIORIDADE_CONSULTA
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"navegador-{indice}")
+
+    def garantir_driver(self) -> WebDriver:
+        if self.driver is None:
+            print(f"🚀 Iniciando navegador da sessão {self.indice} ({self.perfil})...")
+            self.driver = criar_driver(self.perfil)
+        return self.driver
+
+    def verificar(self) -> bool:
+        """
+        Garante um driver respondendo. Retorna True se foi preciso recriá-lo.
+        """
+        recriado = False
+        if self.driver is not None and not driver_saudavel(self.driver):
+            self.fechar()
+            recriado = True
+        self.garantir_driver()
+        return recriado
+
+    async def executar(self, func, *args, **kwargs):
+        """
+        Executa func(driver, *args, **kwargs) na thread da sessão e aguarda o resultado.
+        """
+        def chamar():
+            return func(self.garantir_driver(), *args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, chamar)
+
+    def fechar(self):
+        if self.driver:
+            _sessoes_sujas.discard(self.driver.session_id)
+            try:
+                self.driver.quit()
+            except Exception as e:
+                logger.warning(f"⚠️ Erro ao encerrar a sessão {self.indice} ({type(e).__name__})")
+            self.driver = None
+
+
+class DriverPool:
+    """
+    Pool de sessões do Chrome. Cada request faz checkout de uma sessão e a devolve ao terminar,
+    de modo que até `tamanho` requests usam o navegador ao mesmo tempo.
+
+    A fila de espera é por prioridade: uma sessão liberada vai primeiro para agendamentos, depois para
+    consultas e só então para varreduras. Leituras (consulta e varredura) nunca ocupam as últimas
+    `reserva_agendamento` sessões livres.
+    """
+
+    def __init__(self, tamanho: int = DRIVER_POOL_SIZE, reserva_agendamento: int = DRIVER_RESERVA_AGENDAMENTO):
+        self.tamanho = tamanho
+        self.reserva_agendamento = max(0, min(reserva_agendamento, tamanho - 1))
+        self.sessoes = [SessaoNavegador(i) for i in range(tamanho)]
+        self._livres: list[SessaoNavegador] = list(self.sessoes)
+        # Heap de (prioridade, ordem de chegada, future): dentro da mesma classe, FIFO
+        self._fila: list[tuple[int, int, asyncio.Future]] = []
+        self._ordem = itertools.count()
+
+        # 📊 Estatísticas de espera, no total e por classe
+        self.checkouts = 0
+        self.espera_total = 0.0
+        self.espera_maxima = 0.0
+        self.recriacoes = 0
+        self.por_classe = {
+            prioridade: {"checkouts": 0, "aguardando": 0, "em_uso": 0, "espera_total": 0.0, "espera_maxima": 0.0}
+            for prioridade in NOMES_PRIORIDADE
+        }
+
+        # 🔥 Aquecimento
+        self.pronto = False
+        self.aquecidas = 0
+
+    @property
+    def aguardando(self) -> int:
+        return sum(classe["aguardando"] for classe in self.por_classe.values())
+
+    async def aquecer(self):
+        """
+        Inicia todas as sessões, faz login e deixa cada uma parada na agenda.
+        O pool fica pronto se ao menos uma sessão aquecer com sucesso.
+        """
+        print(f"🔥 Aquecendo {self.tamanho} sessão(ões) do navegador...")
+        resultados = await asyncio.gather(
+            *(sessao.executar(aquecer_sessao) for sessao in self.sessoes),
+            return_exceptions=True
+        )
+
+        self.aquecidas = 0
+        for sessao, resultado in zip(self.sessoes, resultados):
+            if isinstance(resultado, Exception):
+                logger.warning(f"⚠️ Falha ao aquecer a sessão {sessao.indice} ({type(resultado).__name__})")
+            elif resultado:
+                self.aquecidas += 1
+
+        self.pronto = self.aquecidas > 0
+        print(f"🔥 {self.aquecidas}/{self.tamanho} sessão(ões) prontas.")
+
+    def _pode_entregar(self, prioridade: int) -> bool:
+        if not self._livres:
+            return False
+        # Leituras deixam as sessões reservadas livres para o próximo agendamento
+        return prioridade == PRIORIDADE_AGENDAMENTO or len(self._livres) > self.reserva_agendamento
+
+    def _despachar(self):
+        """
+        Entrega sessões livres aos primeiros da fila. Quem está no topo é sempre o mais urgente;
+        se nem ele pode levar uma sessão, ninguém atrás dele pode.
+        """
+        while self._fila:
+            prioridade, _, futuro = self._fila[0]
+            if futuro.done():
+                # Desistiu (cancelado) enquanto esperava
+                heapq.heappop(self._fila)
+                continue
+            if not self._pode_entregar(prioridade):
+                return
+            heapq.heappop(self._fila)
+            self.por_classe[prioridade]["em_uso"] += 1
+            sessao = self._livres.pop()
+            # A classe em que a sessão saiu (pode ter sido promovida na fila); devolver() desconta dela
+            sessao.classe = prioridade
+            futuro.set_result(sessao)
+
+    async def adquirir(self, prioridade: int = PRIORIDADE_CONSULTA) -> SessaoNavegador:
+        # Dentro de uma leitura compartilhada, vale a prioridade do interessado mais urgente
+        pedido = pedido_compartilhado.get()
+        if pedido is not None:
+            prioridade = min(prioridade, pedido["prioridade"])
+        inicio = time.monotonic()
+        futuro = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._fila, (prioridade, next(self._ordem), futuro))
+        if pedido is not None:
+            pedido["futuro"] = futuro
+        self._despachar()
+
+        classe = self.por_classe[prioridade]
+        classe["aguardando"] += 1
+        try:
+            sessao = await futuro
+        except asyncio.CancelledError:
+            # Cancelado logo depois de receber a sessão: ela volta para o pool
+            if futuro.done() and not futuro.cancelled():
+                self.devolver(futuro.result())
+            raise
+        finally:
+            classe["aguardando"] -= 1
+            if pedido is not None:
+                pedido["futuro"] = None
+
+        classe = self.por_classe[sessao.classe]
+        espera = time.monotonic() - inicio
+        self.checkouts += 1
+        self.espera_total += espera
+        self.espera_maxima = max(self.espera_maxima, espera)
+        classe["checkouts"] += 1
+        classe["espera_total"] += espera
+        classe["espera_maxima"] = max(classe["espera_maxima"], espera)
+
+        # 🩺 Verifica a sessão antes de entregá-la; se morreu, recria
+        try:
+            loop = asyncio.get_running_loop()
+            if await loop.run_in_executor(sessao.executor, sessao.verificar):
+                self.recriacoes += 1
+        except BaseException:
+            # Inclui o cancelamento da tarefa: a sessão nunca pode sumir do pool
+            self.devolver(sessao)
+            raise
+
+        sessao.usos += 1
+        return sessao
+
+    def promover(self, futuro: asyncio.Future, prioridade: int):
+        """
+        Recoloca na fila, com prioridade maior, um pedido que ainda espera sessão.
+        A entrada antiga fica no heap e é descartada quando chegar ao topo (o future já estará resolvido).
+        """
+        if futuro.done():
+            return
+        heapq.heappush(self._fila, (prioridade, next(self._ordem), futuro))
+        self._despachar()
+
+    def devolver(self, sessao: SessaoNavegador):
+        self.por_classe[sessao.classe]["em_uso"] -= 1
+        self._livres.append(sessao)
+        self._despachar()
+
+    @asynccontextmanager
+    async def sessao(self, prioridade: int = PRIORIDADE_CONSULTA):
+        sessao = await self.adquirir(prioridade)
+        try:
+            yield sessao
+        finally:
+            self.devolver(sessao)
+
+    def estatisticas(self) -> dict:
+        return {
+            "pronto": self.pronto,
+            "aquecidas": self.aquecidas,
+            "tamanho": self.tamanho,
+            "livres": len(self._livres),
+            "em_uso": self.tamanho - len(self._livres),
+            "aguardando": self.aguardando,
+            "reserva_agendamento": self.reserva_agendamento,
+            "iniciadas": sum(1 for s in self.sessoes if s.driver is not None),
+            "checkouts": self.checkouts,
+            "espera_media_s": round(self.espera_total / self.checkouts, 3) if self.checkouts else 0.0,
+            "espera_maxima_s": round(self.espera_maxima, 3),
+            "recriacoes": self.recriacoes,
+            "classes": {
+                NOMES_PRIORIDADE[prioridade]: {
+                    "aguardando": classe["aguardando"],
+                    "em_uso": classe["em_uso"],
+                    "checkouts": classe["checkouts"],
+                    "espera_media_s": round(classe["espera_total"] / classe["checkouts"], 3)
+                    if classe["checkouts"] else 0.0,
+                    "espera_maxima_s": round(classe["espera_maxima"], 3),
+                }
+                for prioridade, classe in self.por_classe.items()
+            },
+        }
+
+    def fechar(self):
+        for sessao in self.sessoes:
+            sessao.fechar()
+            sessao.executor.shutdown(wait=False)
+
 
-# 🧠 Inicializa o navegador com perfil persistente
-def get_driver():
-    global _driver
-    if _driver is None:
-        # Obtém a URL remota do Selenium, se definida
-        remote_url = os.getenv("SELENIUM_REMOTE_URL") or False
-
-        # Se estivermos em ambiente local e NÃO utilizando Selenium remoto, verifica o bloqueio do perfil
-        if os.getenv("ENV") == "local" and not remote_url:
-            lock_path = os.path.join(CHROME_PROFILE, "SingletonLock")
-            if os.path.exists(lock_path):
-                raise RuntimeError("⚠️ Perfil do Chrome está em uso. Finalize o container anterior.")
-
-        options = Options()
-        # Só adiciona o user-data-dir se NÃO estivermos usando o driver remoto
-        if not remote_url:
-            options.add_argument(f"user-data-dir={CHROME_PROFILE}")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--no-sandbox")
-        # Ativa o modo headless quando NÃO estiver em ambiente local (ou seja, quando rodando via API/Render)
-        if os.getenv("ENV") != "local":
-            options.add_argument("--headless=new")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--disable-software-rasterizer")
-        options.add_argument("--disable-extensions")
-        options.add_argument("--disable-infobars")
-        options.add_argument("--disable-features=VizDisplayCompositor")
-        options.add_argument("--log-level=3")
-        options.add_argument("--silent")
-
-        if remote_url:
-            # Conecta ao Selenium remoto (por exemplo, container Selenium)
-            _driver = webdriver.Remote(
-                command_executor=remote_url,
-                options=options
-            )
-        else:
-            # Caso contrário, utiliza o driver local (Chrome instalado no container)
-            service = Service(log_path=os.devnull)
-            _driver = webdriver.Chrome(service=service, options=options)
-
-        _driver.set_window_size(1920, 1080)
-        _driver.set_page_load_timeout(30)
-    return _driver
+driver_pool = DriverPool()
 
 
 def fechar_driver():
-    global _driver
-    if _driver:
-        _driver.quit()
-        _driver = None
+    driver_pool.fechar()
 
 
 def extrair_cookies_selenium(driver) -> dict:
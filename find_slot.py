@@ -1,10 +1,16 @@
 # 🗂 Bibliotecas
+import asyncio
+import json
+import os
 import time
+from uuid import uuid4
 
+import requests
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException, StaleElementReferenceException
+from selenium.common.exceptions import TimeoutException
 from typing import Union, Optional
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
@@ -16,241 +22,702 @@ import logging
 from code_sup import RequisicaoHorario
 
 # 🧭 Navegador
-from driver_utils import get_driver, driver_lock
-
-# 🔐 Sessão e login
-from auth_utils import sessao_ja_logada, fazer_login
+from driver_utils import (driver_pool, garantir_agenda, extrair_cookies_selenium, marcar_sessao_suja,
+                          promover_pedido, pedido_compartilhado, PRIORIDADE_CONSULTA, PRIORIDADE_VARREDURA,
+                          NOMES_PRIORIDADE)
 
 # 💾 Redis
-from redis_utils import registrar_agendamento, ja_foi_enviado
+from redis_utils import (registrar_agendamentos_async, horarios_ja_enviados_async, reservar_horario_async,
+                         reservados_por_outros_async, liberar_reservas_do_usuario_async)
 
 # 📆 Horários e datas
-from date_times import navegar_para_data, extrair_horarios_de_bloco
+from date_times import navegar_para_data
+
+# ⚡ Leitura via HTTP
+from http_utils import fast_path_disponivel, buscar_grade_http_async, cookies_validos, atualizar_cookies, SessaoExpirada
+
+# ⏱ Esperas
+from wait_utils import aguardar_ajax_ocioso
+
+# 🗄️ Cache de disponibilidade
+from cache_utils import (ler_grades_em_cache, gravar_grade_em_cache, ler_vista, inicio_do_dia, travar_leitura,
+                         liberar_leitura, leitura_em_andamento, gravar_grade_bruta, ler_grade_bruta)
+
+# 🗓️ Grade de horários
+from grade_utils import extrair_grade, capturar_html_grade, parsear_grade_html_async, horarios_da_especialidade
 
 # 📅 Agendamento
 # from booking import extrair_consultorio_do_bloco
 
 # 📑 Modelos e lifespan
-from code_sup import print_caixa
+from code_sup import print_caixa, normalizar_nome, similar
 
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Quantos dias a partir da data pedida entram na busca
+DIAS_BUSCA = 10
+
+# Como a grade é lida: "js" (execute_script) ou "html" (snapshot + BeautifulSoup fora do navegador)
+MODO_GRADE = os.getenv("MODO_GRADE", "js").lower()
+
+# Quanto tempo esperar pela leitura que outro processo está fazendo antes de ler por conta própria (segundos)
+ESPERA_LEITURA_ALHEIA = float(os.getenv("ESPERA_LEITURA_ALHEIA", "30"))
+
+# Leituras em andamento neste processo: chave -> {"tarefa", "esperando"}. Pedidos simultâneos esperam a mesma
+# tarefa; quando o último desiste, ela é cancelada e devolve a sessão do navegador
+_leituras_em_voo: dict[str, dict] = {}
+
+# Releituras em segundo plano (o event loop só guarda referências fracas)
+_revalidacoes: set[asyncio.Task] = set()
+
+
+def carregar_dia(driver, data_atual: datetime):
+    """
+    Roda na thread da sessão do navegador: abre a data e captura a grade.
+    Retorna a grade (MODO_GRADE=js), o HTML do quadro (MODO_GRADE=html) ou None se a data não abriu
+    ou a grade não pôde ser extraída.
+    """
+    wait = WebDriverWait(driver, 20)
+    # TODO só se der problema nas abas
+    # garantir_aba_principal(driver)  # 🧠 Garante que estamos na aba certa
+    first_login = garantir_agenda(driver, wait)
+
+    data_str = data_atual.strftime("%d/%m/%Y")
+    print(f"📆 Tentando data {data_str}...")
+
+    disp = True
+    if not navegar_para_data(driver, wait, data_atual, first_login, disp):
+        print(f"❌ Não foi possível acessar a data {data_str}")
+        marcar_sessao_suja(driver)
+        return None
+
+    try:
+        wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "table.table-hover")))
+        print("✅ Tabela de horários apareceu.\n")
+    except TimeoutException:
+        print("⛔ Tabela não apareceu após seleção. Pulando para próxima data.")
+        marcar_sessao_suja(driver)
+        return None
+
+    # Renova os cookies da leitura via HTTP depois de um login ou de uma expiração
+    if first_login or not cookies_validos():
+        atualizar_cookies(extrair_cookies_selenium(driver))
+
+    # Garante visibilidade da grade
+    driver.execute_script("""
+                    const el = document.getElementById('contQuadro');
+                    if (el) {
+                        el.scrollLeft = el.scrollWidth;
+                    }
+                """)
+    aguardar_ajax_ocioso(driver)
+
+    if MODO_GRADE == "html":
+        # Só o HTML sai do navegador; o parse acontece depois, com a sessão já devolvida ao pool
+        return capturar_html_grade(driver)
+
+    # Uma única ida ao chromedriver traz a grade inteira; o filtro é feito em Python
+    grade = extrair_grade(driver)
+    if grade is None:
+        marcar_sessao_suja(driver)
+    return grade
+
+
+async def ler_grade_do_dia(data_atual: datetime, prioridade: int = PRIORIDADE_CONSULTA) -> list[dict] | None:
+    # ⚡ Caminho rápido: uma requisição HTTP com os cookies do navegador, sem renderizar a página
+    if fast_path_disponivel():
+        try:
+            return await buscar_grade_http_async(data_atual)
+        except SessaoExpirada:
+            print("🔐 Sessão HTTP expirada. Voltando ao navegador...")
+        except requests.RequestException as e:
+            logger.warning(f"⚠️ Falha na leitura via HTTP, usando o navegador ({type(e).__name__})")
 
-async def buscar_primeiro_horario(especialidade: str, solicitante_id: str, data: Optional[str] = None,
-                                  minutos_ate_disponivel: int = 0) -> Union[dict[str, str], None]:
-    async with driver_lock:
-        driver = get_driver()
-        wait = WebDriverWait(driver, 20)
-        # TODO só se der problema nas abas
-        # garantir_aba_principal(driver)  # 🧠 Garante que estamos na aba certa
-
-        if data:
-            buscar_data = data
-        else:
-            buscar_data = datetime.today().strftime('%d/%m/%Y')  # ou outro formato que você usa
+    async with driver_pool.sessao(prioridade) as sessao:
+        try:
+            captura = await sessao.executar(carregar_dia, data_atual)
+        except Exception:
+            marcar_sessao_suja(sessao.driver)
+            raise
+
+    if captura is None:
+        return None
+    if MODO_GRADE == "html":
+        return await parsear_grade_html_async(captura)
+    return captura
+
+
+async def horarios_do_dia(especialidade: str, data_atual: datetime, prioridade: int = PRIORIDADE_CONSULTA
+                          ) -> list[tuple[str, str, str]] | None:
+    """
+    Lê a grade da data, filtra pela especialidade e guarda o resultado no cache compartilhado.
+    Retorna None se a data não pôde ser lida (nesse caso nada vai para o cache).
+    """
+    # Uma data com erro não derruba a varredura inteira
+    try:
+        grade = await grade_do_dia_compartilhada(data_atual, prioridade)
+        if grade is None:
+            return None
+
+        horarios = horarios_da_especialidade(grade, especialidade)
+        await gravar_grade_em_cache(especialidade, data_atual.strftime("%d/%m/%Y"), horarios)
+        return horarios
+
+    except Exception as e:
+        logger.warning(f"⚠️ Erro ao ler a data {data_atual.strftime('%d/%m/%Y')} ({type(e).__name__})")
+        return None
+
+
+async def aguardar_leitura_alheia(especialidade: str, data_str: str) -> list[tuple[str, str, str]] | None:
+    """
+    Outro processo está lendo esta data: espera a grade fresca aparecer no cache.
+    Retorna None se a trava sumir sem grade nova ou se o tempo acabar.
+    """
+    prazo = time.monotonic() + ESPERA_LEITURA_ALHEIA
+    while time.monotonic() < prazo:
+        await asyncio.sleep(0.25)
+        grade = (await ler_grades_em_cache(especialidade, [data_str])).get(data_str)
+        if grade and not grade["obsoleta"]:
+            return grade["horarios"]
+        if not await leitura_em_andamento(especialidade, data_str):
+            return None
+    return None
+
+
+async def _ler_uma_vez(especialidade: str, data_atual: datetime, prioridade: int
+                       ) -> list[tuple[str, str, str]] | None:
+    data_str = data_atual.strftime("%d/%m/%Y")
+    dono = uuid4().hex
+
+    try:
+        travou = await travar_leitura(especialidade, data_str, dono)
+        if not travou:
+            print(f"⏳ Outro processo já está lendo {data_str}. Aguardando o cache...")
+            horarios = await aguardar_leitura_alheia(especialidade, data_str)
+            if horarios is not None:
+                return horarios
+    except Exception as e:
+        # Sem Redis para coordenar, cada processo lê por conta própria
+        logger.warning(f"⚠️ Sem trava de leitura para {data_str} ({type(e).__name__})")
+        travou = False
+
+    try:
+        return await horarios_do_dia(especialidade, data_atual, prioridade)
+    finally:
+        if travou:
+            try:
+                await liberar_leitura(especialidade, data_str, dono)
+            except Exception as e:
+                logger.warning(f"⚠️ Não foi possível liberar a trava de {data_str} ({type(e).__name__})")
+
+
+async def _rodar_com_pedido(pedido: dict, fabrica):
+    # O pedido fica no contexto da tarefa: o DriverPool o encontra ao entrar na fila e o registra lá
+    pedido_compartilhado.set(pedido)
+    return await fabrica()
+
+
+async def compartilhar_leitura(chave: str, fabrica, descricao: str, prioridade: int = PRIORIDADE_CONSULTA):
+    """
+    Single-flight em processo: o primeiro pedido cria a tarefa (`fabrica()`), os seguintes esperam a mesma.
+    Cada pedido conta como um interessado; se todos desistirem (ex.: já acharam horário num dia mais cedo),
+    a leitura é cancelada em vez de seguir ocupando o navegador.
+    A leitura usa a prioridade do interessado mais urgente: um paciente que entra numa leitura iniciada
+    por uma varredura a faz subir na fila do pool, em vez de esperar atrás de todas as consultas.
+    """
+    entrada = _leituras_em_voo.get(chave)
+    if entrada is None:
+        pedido = {"prioridade": prioridade, "futuro": None, "dependentes": []}
+        # Leitura compartilhada aberta de dentro de outra (ex.: a da especialidade lendo a grade inteira):
+        # promover a de fora promove esta também
+        externo = pedido_compartilhado.get()
+        if externo is not None:
+            externo["dependentes"].append(pedido)
+        entrada = {"tarefa": asyncio.create_task(_rodar_com_pedido(pedido, fabrica)), "esperando": 0,
+                   "pedido": pedido}
+        _leituras_em_voo[chave] = entrada
+
+        def _descartar(_, entrada=entrada):
+            if _leituras_em_voo.get(chave) is entrada:
+                del _leituras_em_voo[chave]
+
+        entrada["tarefa"].add_done_callback(_descartar)
+    else:
+        print(f"🤝 Aproveitando a leitura de {descricao} já em andamento.")
+        if prioridade < entrada["pedido"]["prioridade"]:
+            print(f"⏫ Leitura de {descricao} promovida para {NOMES_PRIORIDADE[prioridade]}.")
+            promover_pedido(entrada["pedido"], prioridade)
+        externo = pedido_compartilhado.get()
+        if externo is not None:
+            externo["dependentes"].append(entrada["pedido"])
+            promover_pedido(entrada["pedido"], externo["prioridade"])
+
+    entrada["esperando"] += 1
+    try:
+        # shield: quem desiste não cancela a leitura dos outros interessados
+        return await asyncio.shield(entrada["tarefa"])
+    finally:
+        entrada["esperando"] -= 1
+        if entrada["esperando"] == 0 and not entrada["tarefa"].done():
+            # Ninguém mais espera: sai do dict já, para um pedido novo não pegar a tarefa sendo cancelada
+            if _leituras_em_voo.get(chave) is entrada:
+                del _leituras_em_voo[chave]
+            entrada["tarefa"].cancel()
+
+
+async def aguardar_grade_alheia(data_str: str, desde: float) -> list[dict] | None:
+    """
+    Outro processo está lendo a grade inteira desta data: espera ela aparecer no Redis.
+    Retorna None se a trava sumir sem grade nova ou se o tempo acabar.
+    """
+    prazo = time.monotonic() + ESPERA_LEITURA_ALHEIA
+    while time.monotonic() < prazo:
+        await asyncio.sleep(0.25)
+        grade = await ler_grade_bruta(data_str, desde)
+        if grade is not None:
+            return grade
+        if not await leitura_em_andamento(None, data_str):
+            return None
+    return None
+
+
+async def _ler_grade_uma_vez(data_atual: datetime, prioridade: int) -> list[dict] | None:
+    data_str = data_atual.strftime("%d/%m/%Y")
+    dono = uuid4().hex
+    desde = time.time()
+
+    try:
+        travou = await travar_leitura(None, data_str, dono)
+        if not travou:
+            print(f"⏳ Outro processo já está lendo a grade de {data_str}. Aguardando...")
+            grade = await aguardar_grade_alheia(data_str, desde)
+            if grade is not None:
+                return grade
+    except Exception as e:
+        # Sem Redis para coordenar, cada processo lê por conta própria
+        logger.warning(f"⚠️ Sem trava de leitura para {data_str} ({type(e).__name__})")
+        travou = False
+
+    try:
+        grade = await ler_grade_do_dia(data_atual, prioridade)
+        if grade is not None and travou:
+            try:
+                await gravar_grade_bruta(data_str, grade)
+            except Exception as e:
+                logger.warning(f"⚠️ Não foi possível guardar a grade de {data_str} ({type(e).__name__})")
+        return grade
+    finally:
+        if travou:
+            try:
+                await liberar_leitura(None, data_str, dono)
+            except Exception as e:
+                logger.warning(f"⚠️ Não foi possível liberar a trava de {data_str} ({type(e).__name__})")
+
+
+async def grade_do_dia_compartilhada(data_atual: datetime, prioridade: int = PRIORIDADE_CONSULTA
+                                     ) -> list[dict] | None:
+    """
+    Grade inteira da data (todas as especialidades), lida uma única vez por vez: neste processo pedidos
+    simultâneos esperam a mesma tarefa; entre processos, a trava no Redis faz os demais esperarem a grade.
+    Serve tanto ao /find_slot (via horarios_do_dia) quanto ao lote.
+    """
+    data_str = data_atual.strftime("%d/%m/%Y")
+    return await compartilhar_leitura(
+        f"*:{data_str}",
+        lambda: _ler_grade_uma_vez(data_atual, prioridade),
+        f"{data_str} (grade inteira)",
+        prioridade
+    )
 
-        print("\n🧭 Acessando AmorSaúde...")
-        print_buscar = {
-            "Paciente ID": solicitante_id,
-            "Especialidade": especialidade,
-            "Data solicitada": buscar_data
-        }
 
-        buscando = print_caixa("Buscando horário", print_buscar)
-        print(buscando)
+async def horarios_do_dia_compartilhado(especialidade: str, data_atual: datetime,
+                                        prioridade: int = PRIORIDADE_CONSULTA
+                                        ) -> list[tuple[str, str, str]] | None:
+    """
+    Leitura de (especialidade, data) sem repetição: neste processo, pedidos simultâneos esperam a mesma
+    tarefa; entre processos, a trava no Redis faz os demais esperarem o cache.
+    """
+    data_str = data_atual.strftime("%d/%m/%Y")
+    return await compartilhar_leitura(
+        f"{especialidade.lower()}:{data_str}",
+        lambda: _ler_uma_vez(especialidade, data_atual, prioridade),
+        data_str,
+        prioridade
+    )
 
-        # ⚙️ Limpa ambiente entre chamadas
-        agora = datetime.now(ZoneInfo("America/Sao_Paulo"))
-        limite = agora + timedelta(minutes=minutos_ate_disponivel)
-        data_base = datetime.strptime(data, "%d/%m/%Y") if data else agora
-        print(f"🕒 Agora: {agora.strftime('%d/%m/%Y %H:%M')} — ⏳ Limite: {limite.strftime('%d/%m/%Y %H:%M')}")
 
+def revalidar_grade(especialidade: str, data_atual: datetime):
+    """
+    Releitura em segundo plano da grade obsoleta de (especialidade, data); no máximo uma por vez.
+    A própria tarefa conta como interessada, então a releitura não é cancelada quando o paciente sai.
+    """
+    print(f"🔄 Relendo {data_atual.strftime('%d/%m/%Y')} de {especialidade} em segundo plano...")
+    # Ninguém está esperando por ela: vai para o fim da fila do navegador
+    tarefa = asyncio.create_task(horarios_do_dia_compartilhado(especialidade, data_atual,
+                                                               prioridade=PRIORIDADE_VARREDURA))
+    _revalidacoes.add(tarefa)
+    tarefa.add_done_callback(_revalidacoes.discard)
+
+
+def emitir(eventos: asyncio.Queue | None, evento: str, **dados):
+    """
+    Publica um evento de progresso para o /find_slot/stream; sem fila (chamadas normais), não faz nada.
+    """
+    if eventos is not None:
+        eventos.put_nowait({"evento": evento, **dados})
+
+
+def aplicar_filtros(horarios: list[tuple[str, str, str]], filtros: dict | None) -> list[tuple[str, str, str]]:
+    """
+    Filtros opcionais do pedido: faixa de horário ("hora_minima"/"hora_maxima", HH:MM, inclusivos)
+    e profissional (nome aproximado, como no agendamento).
+    """
+    if not filtros:
+        return horarios
+
+    hora_minima = filtros.get("hora_minima")
+    hora_maxima = filtros.get("hora_maxima")
+    profissional = normalizar_nome(filtros["profissional"]) if filtros.get("profissional") else None
+
+    filtrados = []
+    for (h, m, c) in horarios:
+        # HH:MM com zero à esquerda: a comparação de strings segue a ordem do relógio
+        if hora_minima and h.zfill(5) < hora_minima.zfill(5):
+            continue
+        if hora_maxima and h.zfill(5) > hora_maxima.zfill(5):
+            continue
+        if profissional:
+            medico = normalizar_nome(m)
+            if profissional not in medico and similar(profissional, medico) < 0.75:
+                continue
+        filtrados.append((h, m, c))
+    return filtrados
+
+
+async def escolher_horarios(todos_horarios: list[tuple[str, str, str]], especialidade: str, solicitante_id: str,
+                            data_atual: datetime, agora: datetime, limite: datetime, quantidade: int = 1,
+                            filtros: dict | None = None) -> list[dict[str, str]]:
+    """
+    Escolhe até `quantidade` horários livres da data, reservando e registrando cada um para o paciente.
+    Com quantidade=0, lista todos os horários válidos da data, sem reservar nem registrar nada.
+    """
+    data_str = data_atual.strftime("%d/%m/%Y")
+
+    if not todos_horarios:
+        print(f"⚠️ Nenhum horário na data {data_str}, tentando próxima...")
+        return []
+
+    def converter_para_datetime(hora_str):
         try:
-            driver.get("https://amor-saude.feegow.com/pre-v7.6/?P=AgendaMultipla&Pers=1")
+            hora_dt = datetime.strptime(hora_str, "%H:%M")
+            dt_local = datetime.combine(data_atual.date(), hora_dt.time())
+            dt_conv = dt_local.replace(tzinfo=ZoneInfo("America/Sao_Paulo"))
+            return dt_conv
+        except ValueError as e2:
+            print(f"Erro ao converter '{hora_str}' para datetime: {e2}")
+            return None
+
+    # Filtra os horários válidos
+    horarios_validos = []
+    for (h, m, c) in todos_horarios:
+        # print(f"Testando horário: {h}, Médico: {m}")
+        dt = converter_para_datetime(h)
+        if dt is None:
+            continue
+
+        # Se a data do agendamento for hoje, aplica o limite
+        if data_atual.date() == agora.date():
+            # print("É data atual")
+            if dt >= limite:
+                # print("Horário é depois do limite minimo")
+                horarios_validos.append((h, m, c))
+        else:
+            # Para datas futuras, não aplica o limite
+            # print("Data desejada não é hoje")
+            horarios_validos.append((h, m, c))
+
+        # print(f"horarios validos 1: {horarios_validos}")
+
+
+    horarios_validos = aplicar_filtros(horarios_validos, filtros)
+
+    if not horarios_validos:
+        logger.info(f"⚠️ Nenhum horário válido encontrado em {data_str}. Tentando próxima data...")
+        return []
+
+    # 📋 Modo lista: mostra o que está livre na janela (sem o que já foi reservado para outro paciente),
+    # sem reservar nada
+    if quantidade == 0:
+        reservados = await reservados_por_outros_async(solicitante_id, especialidade, data_str,
+                                                       [(h, m) for (h, m, _) in horarios_validos])
+        return [
+            {"data": data_str, "proximo_horario": h, "medico": m}
+            for (h, m, _) in sorted(horarios_validos, key=lambda x: converter_para_datetime(x[0]))
+            if (h, m) not in reservados
+        ]
+
+    # print(f"horarios validos 2: {horarios_validos}")
+
+    # Uma única ida ao Redis para todos os horários do dia; o resultado serve à ordenação e aos logs
+    ja_enviados = await horarios_ja_enviados_async(solicitante_id, especialidade, data_str,
+                                             [(h, m) for (h, m, _) in horarios_validos])
+
+    proximos_horarios = sorted(
+        [
+            # (h, m, c) para cada horário válido em horarios_validos
+            (h, m, c) for (h, m, c) in horarios_validos
+            if (h, m) not in ja_enviados
+        ],
+        key=lambda x: converter_para_datetime(x[0])
+    )
+
+    # Adicionando logs
+    logger.info("Iniciando filtragem dos horários válidos.")
+    for h, m, _ in horarios_validos:
+        if (h, m) not in ja_enviados:
+            logger.debug(f"Horário válido encontrado: {h}:{m}")
+        else:
+            logger.debug(f"Horário DESCONSIDERADO (já enviado): {h}:{m}")
+
+    logger.info(f"Horários filtrados: {[(h, m) for (h, m, _) in proximos_horarios]}")
+
+    # Após a ordenação
+    logger.info("Horários filtrados e ordenados com sucesso.")
 
-            if not sessao_ja_logada(driver):
-                print("🔐 Sessão não ativa. Realizando login...")
-                first_login = True
-                fazer_login(driver, wait)
+    if not proximos_horarios:
+        return []
+    print(f"proximos horarios: {proximos_horarios}")
+
+    # 🔒 Reserva atômica: se outro paciente levou o horário em paralelo, tenta o próximo
+    escolhidos = []
+    for proximo_horario, medico, consultorio in proximos_horarios:
+        if len(escolhidos) >= quantidade:
+            break
+        if await reservar_horario_async(solicitante_id, especialidade, data_str, proximo_horario, medico):
+            escolhidos.append((proximo_horario, medico, consultorio))
+        else:
+            print(f"🔒 {proximo_horario} com {medico} já reservado para outro paciente. Tentando o próximo...")
+
+    if not escolhidos:
+        return []
+
+    await registrar_agendamentos_async(solicitante_id, especialidade, data_str, escolhidos)
+    print("Registrou o agendamento")
+    return [
+        {"data": data_str, "proximo_horario": proximo_horario, "medico": medico}
+        for proximo_horario, medico, _ in escolhidos
+    ]
+
+
+async def ler_pela_vista(especialidade: str, datas: list[datetime]) -> dict[str, list[tuple[str, str, str]]]:
+    """
+    Horários da visão materializada do crawler (proximos:<especialidade>) por data, só para as datas
+    da janela que a visão cobre (com ou sem horários). As demais ficam para o cache e a varredura.
+    Nada é reservado aqui: as datas são avaliadas junto com as da varredura, em ordem.
+    """
+    inicio = inicio_do_dia(datas[0].strftime("%d/%m/%Y"))
+    vista = await ler_vista(especialidade, inicio, inicio + timedelta(days=len(datas)))
+    if vista is None:
+        return {}
+
+    membros, cobertas = vista
+    por_data = {data_atual.strftime("%d/%m/%Y"): [] for data_atual in datas
+                if data_atual.strftime("%d/%m/%Y") in cobertas}
+    for data_str, hora, medico, consultorio in membros:
+        if data_str in por_data:
+            por_data[data_str].append((hora, medico, consultorio))
+    print(f"📈 {len(membros)} horário(s) na visão pré-calculada de {especialidade} "
+          f"({len(por_data)}/{len(datas)} data(s) cobertas).")
+    return por_data
+
+
+def montar_resultado(encontrados: list[dict]) -> dict:
+    # Visão e varredura podem contribuir com datas diferentes: a lista final segue a ordem do relógio
+    encontrados = sorted(encontrados, key=lambda x: (datetime.strptime(x["data"], "%d/%m/%Y"),
+                                                    x["proximo_horario"].zfill(5)))
+    return {**encontrados[0], "horarios": encontrados}
+
+
+async def buscar_primeiro_horario(especialidade: str, solicitante_id: str, data: Optional[str] = None,
+                                  minutos_ate_disponivel: int = 0, quantidade: int = 1,
+                                  filtros: dict | None = None, eventos: asyncio.Queue | None = None
+                                  ) -> Union[dict[str, str], None]:
+    """
+    Busca os `quantidade` horários livres mais cedo na janela de DIAS_BUSCA dias (0 = listar todos).
+    O primeiro vem nos campos de sempre; a lista completa, em "horarios".
+    Com `eventos`, publica o progresso (cada dia avaliado e cada horário escolhido) para o modo stream.
+    """
+    if data:
+        buscar_data = data
+    else:
+        buscar_data = datetime.today().strftime('%d/%m/%Y')  # ou outro formato que você usa
+
+    print("\n🧭 Acessando AmorSaúde...")
+    print_buscar = {
+        "Paciente ID": solicitante_id,
+        "Especialidade": especialidade,
+        "Data solicitada": buscar_data
+    }
+
+    buscando = print_caixa("Buscando horário", print_buscar)
+    print(buscando)
+
+    # ⚙️ Limpa ambiente entre chamadas
+    agora = datetime.now(ZoneInfo("America/Sao_Paulo"))
+    limite = agora + timedelta(minutes=minutos_ate_disponivel)
+    data_base = datetime.strptime(data, "%d/%m/%Y") if data else agora
+    print(f"🕒 Agora: {agora.strftime('%d/%m/%Y %H:%M')} — ⏳ Limite: {limite.strftime('%d/%m/%Y %H:%M')}")
+
+    datas = [data_base + timedelta(days=dias_adiante) for dias_adiante in range(0, DIAS_BUSCA)]
+    leituras: dict[str, asyncio.Task] = {}
+
+    try:
+        # 🔓 Pedir de novo é recusar o que foi oferecido: as reservas anteriores voltam para os outros pacientes
+        if quantidade:
+            await liberar_reservas_do_usuario_async(solicitante_id, especialidade)
+
+        # 📈 Visão pré-calculada pelo crawler: as datas que ela cobre não precisam de cache nem de navegador
+        vista = await ler_pela_vista(especialidade, datas)
+
+        # 🗄️ Uma ida ao Redis traz as datas que outro paciente acabou de consultar (e a idade das da visão)
+        em_cache = await ler_grades_em_cache(especialidade, [d.strftime("%d/%m/%Y") for d in datas])
+        if em_cache:
+            print(f"🗄️ {len(em_cache)} data(s) servida(s) pelo cache.")
+
+        # ♻️ Grade obsoleta (dentro de CACHE_GRADE_OBSOLETO) é servida já e relida em segundo plano.
+        # Servir dado antigo é seguro: o horário só sai depois da reserva atômica em escolher_horarios.
+        for data_atual in datas:
+            data_str = data_atual.strftime("%d/%m/%Y")
+            grade = em_cache.get(data_str)
+            if data_str not in vista and grade and grade["obsoleta"]:
+                revalidar_grade(especialidade, data_atual)
+
+        # 🔀 As datas fora da visão e do cache são lidas em paralelo (sessões do pool ou HTTP), mas avaliadas
+        # em ordem junto com as demais: assim que os `quantidade` horários mais cedo são conhecidos, o resto
+        # é cancelado. As leituras só começam na primeira data que precisa delas — se a visão e o cache
+        # já bastam antes disso, nenhum navegador é usado.
+        # Cada data é lida uma vez só, mesmo com vários pacientes buscando ao mesmo tempo (compartilhar_leitura);
+        # uma leitura compartilhada só para quando ninguém mais a espera.
+        encontrados = []
+
+        for indice, data_atual in enumerate(datas):
+            data_str = data_atual.strftime("%d/%m/%Y")
+            grade = em_cache.get(data_str)
+            if data_str in vista:
+                horarios, idade, origem = vista[data_str], grade["idade"] if grade else None, "vista"
+            elif grade:
+                horarios, idade, origem = grade["horarios"], grade["idade"], "cache"
             else:
-                print("🔓 Sessão já autenticada.")
-                first_login = False
-
-            for dias_adiante in range(0, 10):  # tenta pelos próximos 10 dias
-                data_atual = data_base + timedelta(days=dias_adiante)
-                data_str = data_atual.strftime("%d/%m/%Y")
-                print(f"📆 Tentando data {data_str}...")
-
-                disp = True
-                if not navegar_para_data(driver, wait, data_atual, first_login, disp):
-                    print(f"❌ Não foi possível acessar a data {data_str}")
-                    continue
-
-                try:
-                    wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "table.table-hover")))
-                    print("✅ Tabela de horários apareceu.\n")
-                except TimeoutException:
-                    print("⛔ Tabela não apareceu após seleção. Pulando para próxima data.")
-                    continue
-
-                # Garante visibilidade da grade
-                driver.execute_script("""
-                                const el = document.getElementById('contQuadro');
-                                if (el) {
-                                    el.scrollLeft = el.scrollWidth;
-                                }
-                            """)
-                time.sleep(1)
-                blocos = driver.find_elements(By.CSS_SELECTOR, "td[id^='pf']")
-                todos_horarios = []
-
-                for bloco in blocos:
-                    max_tentativas = 2
-                    sucesso = False  # indicador se o bloco foi processado com sucesso
-                    for tentativa in range(max_tentativas):
-                        try:
-                            # Reobtém o bloco específico dentro da lista atual de blocos
-                            blocos = driver.find_elements(By.CSS_SELECTOR, "td[id^='pf']")
-                            # Verifica se o índice do bloco atual ainda é válido
-                            index = blocos.index(bloco) if bloco in blocos else None
-                            if index is None:
-                                print(f"❌ Bloco '{bloco.text}' não está mais disponível. Ignorando.")
-                                break  # Sai do loop interno para começar outro bloco
-
-                            bloco = blocos[index]  # Reassocia ao bloco válido
-
-                            # Processa o bloco normalmente
-                            medico_raw = bloco.find_element(By.CSS_SELECTOR, "div")
-                            medico = medico_raw.text.strip().split("\n")[0]
-                            horarios = extrair_horarios_de_bloco(bloco, especialidade)
-
-                            if horarios:  # Apenas adiciona se houver horários encontrados
-                                for h in horarios:
-                                    todos_horarios.append((h, medico))
-
-                            # print(f"Todos os horários: {todos_horarios}")
-                            sucesso = True  # deu certo neste bloco
-                            break  # sai do loop de tentativas para este bloco
-
-                        except (NoSuchElementException, StaleElementReferenceException):
-                                # TODO tirei o 'as e:', ver se deu erro
-                                # logger.warning(
-                                #     f"⚠️ Erro ao acessar bloco na tentativa {tentativa + 1} ({type(e).__name__}).")
-                                time.sleep(0.5)  # Pequena pausa antes da próxima tentativa
-
-                    if not sucesso:
-                        # Esse else é executado se nenhuma tentativa for bem-sucedida
-                        # TODO VERIFICAR SE DEU CERTO A MUDANÇA
-                        # logger.warning("⚠️ Erro persistente ao acessar bloco. Pulando esse bloco.")
-                        pass
-
-                if not todos_horarios:
-                    print(f"⚠️ Nenhum horário na data {data_str}, tentando próxima...")
-                    continue
-
-                def converter_para_datetime(hora_str):
-                    try:
-                        hora_dt = datetime.strptime(hora_str, "%H:%M")
-                        dt_local = datetime.combine(data_atual.date(), hora_dt.time())
-                        dt_conv = dt_local.replace(tzinfo=ZoneInfo("America/Sao_Paulo"))
-                        return dt_conv
-                    except ValueError as e2:
-                        print(f"Erro ao converter '{hora_str}' para datetime: {e2}")
-                        return None
-
-                # Filtra os horários válidos
-                horarios_validos = []
-                for (h, m) in todos_horarios:
-                    # print(f"Testando horário: {h}, Médico: {m}")
-                    dt = converter_para_datetime(h)
-                    if dt is None:
-                        continue
-
-                    # Se a data do agendamento for hoje, aplica o limite
-                    if data_atual.date() == agora.date():
-                        # print("É data atual")
-                        if dt >= limite:
-                            # print("Horário é depois do limite minimo")
-                            horarios_validos.append((h, m))
-                    else:
-                        # Para datas futuras, não aplica o limite
-                        # print("Data desejada não é hoje")
-                        horarios_validos.append((h, m))
-
-                    # print(f"horarios validos 1: {horarios_validos}")
-
-
-                if not horarios_validos:
-                    logger.info(f"⚠️ Nenhum horário válido encontrado em {data_str}. Tentando próxima data...")
-                    continue
-
-                # print(f"horarios validos 2: {horarios_validos}")
-
-                proximos_horarios = sorted(
-                    [
-                        # (h, m) para cada horário válido em horarios_validos
-                        (h, m) for (h, m) in horarios_validos
-                        if not ja_foi_enviado(solicitante_id, especialidade, data_str, h, m)
-                    ],
-                    key=lambda x: converter_para_datetime(x[0])
-                )
-
-                # Adicionando logs
-                logger.info("Iniciando filtragem dos horários válidos.")
-                for h, m in horarios_validos:
-                    if not ja_foi_enviado(solicitante_id, especialidade, data_str, h, m):
-                        logger.debug(f"Horário válido encontrado: {h}:{m}")
-                    else:
-                        logger.debug(f"Horário DESCONSIDERADO (já enviado): {h}:{m}")
-
-                logger.info(
-                    f"Horários filtrados: {[(h, m) for (h, m) in horarios_validos if not ja_foi_enviado(solicitante_id, especialidade, data_str, h, m)]}")
-
-                # Após a ordenação
-                logger.info("Horários filtrados e ordenados com sucesso.")
-
-                if not proximos_horarios:
-                    continue
-                print(f"proximos horarios: {proximos_horarios}")
-                proximo_horario, medico = proximos_horarios[0]
-                registrar_agendamento(
-                    usuario_id=solicitante_id,
-                    especialidade=especialidade,
-                    data=data_str,
-                    hora=proximo_horario,
-                    medico_nome=medico,
-                    consultorio=""
-                )
-                print("Registrou o agendamento")
-                return {
-                    "data": data_str,
-                    "proximo_horario": proximo_horario,
-                    "medico": medico
-                }
-
-            return {
-                "erro": "Nenhum horário encontrado após 10 dias."
-            }
+                if not leituras:
+                    for seguinte in datas[indice:]:
+                        chave = seguinte.strftime("%d/%m/%Y")
+                        if chave not in vista and chave not in em_cache:
+                            leituras[chave] = asyncio.create_task(
+                                horarios_do_dia_compartilhado(especialidade, seguinte))
+                horarios, idade, origem = await leituras[data_str], 0, "leitura"
+            if horarios is None:
+                emitir(eventos, "dia", data=data_str, horarios=None, origem="erro")
+                continue
+
+            faltam = quantidade - len(encontrados) if quantidade else 0
+            escolhidos = await escolher_horarios(horarios, especialidade, solicitante_id, data_atual, agora, limite,
+                                                 faltam, filtros)
+            emitir(eventos, "dia", data=data_str, horarios=len(horarios), origem=origem)
+            for escolhido in escolhidos:
+                escolhido["idade_dados"] = round(idade) if idade is not None else None
+                emitir(eventos, "horario", **escolhido)
+            encontrados.extend(escolhidos)
+            if quantidade and len(encontrados) >= quantidade:
+                break
+
+        if encontrados:
+            return montar_resultado(encontrados)
 
+        return {
+            "erro": f"Nenhum horário encontrado após {DIAS_BUSCA} dias."
+        }
 
-        except Exception as e:
-            logger.error(f"❌ Erro inesperado: {type(e).__name__}")
-            return {
-                "erro": f"{type(e).__name__}"
-            }
+
+    except Exception as e:
+        logger.error(f"❌ Erro inesperado: {type(e).__name__}")
+        return {
+            "erro": f"{type(e).__name__}"
+        }
+
+    finally:
+        for leitura in leituras.values():
+            leitura.cancel()
 
 
 @router.post("/find_slot")
 async def find_slot(body: RequisicaoHorario):
+    return await responder_find_slot(body)
+
+
+async def responder_find_slot(body: RequisicaoHorario) -> dict:
+    """
+    Corpo do /find_slot, reaproveitado pelo modo job (jobs.py).
+    """
     resultado = await buscar_primeiro_horario(
         body.especialidade,
         body.solicitante_id,  # ✅ adiciona isso aqui
         body.data,
-        body.minutos_ate_disponivel or 0
+        body.minutos_ate_disponivel or 0,
+        body.quantidade,
+        filtros_do_pedido(body)
     )
+    return formatar_resposta(body, resultado)
+
+
+@router.post("/find_slot/stream")
+async def find_slot_stream(body: RequisicaoHorario):
+    """
+    Mesmo que o /find_slot, mas em NDJSON: uma linha por dia avaliado ({"evento": "dia", ...}),
+    uma por horário assim que é escolhido ({"evento": "horario", ...}) e, por fim, a resposta
+    completa ({"evento": "resultado", ...}). Todas trazem "tempo_s" desde o início da busca.
+    """
+    eventos: asyncio.Queue = asyncio.Queue()
+    inicio = time.monotonic()
+
+    async def buscar():
+        try:
+            resultado = await buscar_primeiro_horario(
+                body.especialidade,
+                body.solicitante_id,
+                body.data,
+                body.minutos_ate_disponivel or 0,
+                body.quantidade,
+                filtros_do_pedido(body),
+                eventos
+            )
+            emitir(eventos, "resultado", **formatar_resposta(body, resultado))
+        except Exception as e:
+            # A última linha sempre chega, mesmo se a busca quebrar
+            emitir(eventos, "resultado", status="erro", mensagem=type(e).__name__)
+
+    async def linhas():
+        busca = asyncio.create_task(buscar())
+        try:
+            while True:
+                evento = await eventos.get()
+                evento["tempo_s"] = round(time.monotonic() - inicio, 2)
+                yield json.dumps(evento, ensure_ascii=False) + "\n"
+                if evento["evento"] == "resultado":
+                    break
+        finally:
+            # Cliente desconectou (ou já recebeu o resultado): a busca não segue à toa
+            busca.cancel()
+
+    return StreamingResponse(linhas(), media_type="application/x-ndjson")
+
+
+def filtros_do_pedido(body: RequisicaoHorario) -> dict:
+    return {"hora_minima": body.hora_minima, "hora_maxima": body.hora_maxima, "profissional": body.profissional}
+
 
+def formatar_resposta(body: RequisicaoHorario, resultado: dict | None) -> dict:
     if isinstance(resultado, str) and resultado.lower().startswith("erro"):
         return {
             "status": "erro",
@@ -288,5 +755,9 @@ async def find_slot(body: RequisicaoHorario):
         "especialidade": body.especialidade,
         "medico": resultado.get("medico"),
         "data": resultado.get("data"),
-        "proximo_horario": resultado["proximo_horario"]
+        "proximo_horario": resultado["proximo_horario"],
+        # Segundos desde que a grade usada foi lida do Feegow (0 = lida agora)
+        "idade_dados": resultado.get("idade_dados"),
+        # Os K primeiros (ou todos, com quantidade=0), em ordem; o primeiro é o dos campos acima
+        "horarios": resultado.get("horarios", [])
     }
\ No newline at end of file
@@ -0,0 +1,144 @@
+# 🗂 Bibliotecas
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from fastapi import APIRouter
+import asyncio
+import logging
+
+# 📑 Modelos e lifespan
+from code_sup import RequisicaoHorario
+
+# 🗄️ Cache de disponibilidade
+from cache_utils import ler_grades_em_cache, gravar_grade_em_cache
+
+# 🗓️ Grade de horários
+from grade_utils import horarios_da_especialidade
+
+# 💾 Redis
+from redis_utils import liberar_reservas_do_usuario_async
+
+# 🔎 Busca de horários
+from find_slot import (DIAS_BUSCA, grade_do_dia_compartilhada, revalidar_grade, escolher_horarios, montar_resultado,
+                       filtros_do_pedido, formatar_resposta)
+
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+
+async def ler_grades_da_janela(especialidades: set[str], datas: list[datetime]
+                               ) -> dict[str, dict[str, tuple[list[tuple[str, str, str]], float]]]:
+    """
+    Monta {data: {especialidade: (horarios, idade)}} para a janela inteira.
+    Cada data fora do cache é lida uma única vez e serve a todas as especialidades do lote; a leitura é
+    a mesma compartilhada do /find_slot, então também não se repete entre lotes, pedidos e réplicas.
+    Datas que não puderam ser lidas ficam sem especialidades.
+    """
+    datas_str = [data_atual.strftime("%d/%m/%Y") for data_atual in datas]
+    grades: dict[str, dict] = {data_str: {} for data_str in datas_str}
+
+    for especialidade in especialidades:
+        em_cache = await ler_grades_em_cache(especialidade, datas_str)
+        for data_atual, data_str in zip(datas, datas_str):
+            grade = em_cache.get(data_str)
+            if grade is None:
+                continue
+            grades[data_str][especialidade] = (grade["horarios"], grade["idade"])
+            if grade["obsoleta"]:
+                revalidar_grade(especialidade, data_atual)
+
+    async def ler(data_atual: datetime):
+        data_str = data_atual.strftime("%d/%m/%Y")
+        faltando = [especialidade for especialidade in especialidades if especialidade not in grades[data_str]]
+        if not faltando:
+            return
+
+        try:
+            grade = await grade_do_dia_compartilhada(data_atual)
+        except Exception as e:
+            logger.warning(f"⚠️ Erro ao ler a data {data_str} ({type(e).__name__})")
+            return
+        if grade is None:
+            return
+
+        for especialidade in faltando:
+            horarios = horarios_da_especialidade(grade, especialidade)
+            await gravar_grade_em_cache(especialidade, data_str, horarios)
+            grades[data_str][especialidade] = (horarios, 0)
+
+    await asyncio.gather(*(ler(data_atual) for data_atual in datas))
+    return grades
+
+
+async def atender_pedido(body: RequisicaoHorario, datas: list[datetime], grades: dict, agora: datetime) -> dict:
+    """
+    Escolhe os horários de um paciente a partir das grades já lidas, com as mesmas regras do /find_slot
+    (filtros, dedupe por paciente e reserva atômica).
+    """
+    quantidade = body.quantidade
+    limite = agora + timedelta(minutes=body.minutos_ate_disponivel or 0)
+    encontrados = []
+
+    try:
+        if quantidade:
+            await liberar_reservas_do_usuario_async(body.solicitante_id, body.especialidade)
+
+        for data_atual in datas:
+            data_str = data_atual.strftime("%d/%m/%Y")
+            if body.especialidade not in grades[data_str]:
+                continue
+
+            horarios, idade = grades[data_str][body.especialidade]
+            faltam = quantidade - len(encontrados) if quantidade else 0
+            escolhidos = await escolher_horarios(horarios, body.especialidade, body.solicitante_id, data_atual,
+                                                 agora, limite, faltam, filtros_do_pedido(body))
+            for escolhido in escolhidos:
+                escolhido["idade_dados"] = round(idade)
+            encontrados.extend(escolhidos)
+            if quantidade and len(encontrados) >= quantidade:
+                break
+
+        if encontrados:
+            resultado = montar_resultado(encontrados)
+        else:
+            resultado = {"erro": f"Nenhum horário encontrado após {DIAS_BUSCA} dias."}
+
+    except Exception as e:
+        logger.error(f"❌ Erro inesperado: {type(e).__name__}")
+        resultado = {"erro": f"{type(e).__name__}"}
+
+    return formatar_resposta(body, resultado)
+
+
+@router.post("/find_slot/batch")
+async def find_slot_batch(pedidos: list[RequisicaoHorario]):
+    """
+    Vários pacientes de uma vez: os pedidos são agrupados pela janela de datas, cada data é lida
+    uma vez por grupo e os horários são distribuídos na ordem dos pedidos, sem repetir entre pacientes.
+    Responde uma lista na mesma ordem do corpo.
+    """
+    agora = datetime.now(ZoneInfo("America/Sao_Paulo"))
+    respostas: list[dict | None] = [None] * len(pedidos)
+
+    grupos: dict[str | None, list[int]] = {}
+    for indice, pedido in enumerate(pedidos):
+        grupos.setdefault(pedido.data, []).append(indice)
+
+    print(f"\n📦 Lote com {len(pedidos)} pedido(s) em {len(grupos)} janela(s).")
+
+    # Um grupo por vez: o seguinte já encontra no cache as datas que o anterior leu
+    for data, indices in grupos.items():
+        try:
+            data_base = datetime.strptime(data, "%d/%m/%Y") if data else agora
+        except ValueError:
+            for indice in indices:
+                respostas[indice] = {"status": "erro", "mensagem": f"Data inválida: {data}"}
+            continue
+
+        datas = [data_base + timedelta(days=dias_adiante) for dias_adiante in range(0, DIAS_BUSCA)]
+        grades = await ler_grades_da_janela({pedidos[indice].especialidade for indice in indices}, datas)
+
+        for indice in indices:
+            respostas[indice] = await atender_pedido(pedidos[indice], datas, grades, agora)
+
+    return respostas
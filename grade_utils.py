@@ -0,0 +1,138 @@
+# 🗂 Bibliotecas
+from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+# 🧵 Workers que fazem o parse do HTML capturado, fora das threads do navegador
+PARSER_WORKERS = max(1, int(os.getenv("PARSER_WORKERS", "2")))
+_executor_parse = ThreadPoolExecutor(max_workers=PARSER_WORKERS, thread_name_prefix="parse-grade")
+
+
+# 📜 Lê a grade inteira da AgendaMultipla em uma única chamada ao chromedriver
+SCRIPT_GRADE = """
+const linhas = (el) => el ? el.innerText.trim().split('\\n').map(l => l.trim()) : [];
+
+return Array.from(document.querySelectorAll("td[id^='pf']")).map(bloco => {
+    const titulo = linhas(bloco.querySelector('.panel-title'));
+    const primeiraDiv = linhas(bloco.querySelector('div'));
+
+    // Consultório: TR anterior mais próxima com a célula nomeProf
+    let consultorio = '';
+    let tr = bloco.closest('tr');
+    tr = tr ? tr.previousElementSibling : null;
+    while (tr) {
+        if (tr.querySelector('td.nomeProf')) {
+            consultorio = linhas(tr)[0] || '';
+            break;
+        }
+        tr = tr.previousElementSibling;
+    }
+
+    return {
+        id: bloco.id,
+        profissional: primeiraDiv[0] || '',
+        nome_painel: titulo[0] || '',
+        especialidade: titulo[1] || '',
+        consultorio: consultorio,
+        horarios: Array.from(bloco.querySelectorAll('.btn-info'))
+            .map(botao => botao.innerText.trim())
+            .filter(texto => texto)
+    };
+});
+"""
+
+
+def extrair_grade(driver) -> list[dict] | None:
+    """
+    Retorna a grade da data exibida como lista de blocos:
+    {id, profissional, nome_painel, especialidade, consultorio, horarios}.
+    Retorna None se a extração falhar: uma grade vazia é um "sem horários" de verdade e vai para o cache.
+    """
+    try:
+        grade = driver.execute_script(SCRIPT_GRADE) or []
+    except Exception as e:
+        logger.warning(f"⚠️ Erro ao extrair a grade ({type(e).__name__})")
+        return None
+
+    print(f"🔍 {len(grade)} profissional(is) na grade.")
+    return grade
+
+
+def capturar_html_grade(driver) -> str:
+    """
+    Captura o HTML do quadro de horários (ou da página inteira, se o quadro não existir).
+    """
+    html = driver.execute_script("""
+        const el = document.getElementById('contQuadro');
+        return el ? el.outerHTML : null;
+    """)
+    return html or driver.page_source
+
+
+def _linhas(elemento) -> list[str]:
+    if elemento is None:
+        return []
+    return [linha for linha in elemento.get_text("\n", strip=True).split("\n") if linha]
+
+
+def parsear_grade_html(html: str) -> list[dict]:
+    """
+    Equivalente ao SCRIPT_GRADE, mas sobre um snapshot do HTML: não depende do navegador
+    e não sofre com StaleElementReferenceException.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    grade = []
+
+    for bloco in soup.select("td[id^='pf']"):
+        titulo = _linhas(bloco.select_one(".panel-title"))
+        primeira_div = _linhas(bloco.find("div"))
+
+        # Consultório: TR anterior mais próxima com a célula nomeProf
+        consultorio = ""
+        tr = bloco.find_parent("tr")
+        for anterior in (tr.find_previous_siblings("tr") if tr else []):
+            if anterior.select_one("td.nomeProf"):
+                linhas_tr = _linhas(anterior)
+                consultorio = linhas_tr[0] if linhas_tr else ""
+                break
+
+        grade.append({
+            "id": bloco.get("id"),
+            "profissional": primeira_div[0] if primeira_div else "",
+            "nome_painel": titulo[0] if titulo else "",
+            "especialidade": titulo[1] if len(titulo) > 1 else "",
+            "consultorio": consultorio,
+            "horarios": [texto for botao in bloco.select(".btn-info") if (texto := botao.get_text(strip=True))],
+        })
+
+    print(f"🔍 {len(grade)} profissional(is) na grade (HTML).")
+    return grade
+
+
+async def parsear_grade_html_async(html: str) -> list[dict]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor_parse, parsear_grade_html, html)
+
+
+def horarios_da_especialidade(grade: list[dict], especialidade: str) -> list[tuple[str, str, str]]:
+    """
+    Filtra a grade pela especialidade e devolve (hora, medico, consultorio) de cada horário.
+    """
+    especialidade = especialidade.lower()
+    horarios = []
+
+    for bloco in grade:
+        if not bloco.get("nome_painel"):
+            continue
+        if especialidade not in bloco.get("especialidade", "").lower():
+            continue
+
+        for hora in bloco.get("horarios", []):
+            horarios.append((hora, bloco.get("profissional", ""), bloco.get("consultorio", "")))
+
+    return horarios
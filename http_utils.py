@@ -0,0 +1,86 @@
+# 🗂 Bibliotecas
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import requests
+import asyncio
+import logging
+import os
+
+# 🗓️ Grade de horários
+from grade_utils import parsear_grade_html
+
+
+logger = logging.getLogger(__name__)
+
+# Endpoint que devolve o HTML da grade da AgendaMultipla (o mesmo que a página chama via AJAX).
+# Aceita os campos {data} (dd/mm/aaaa), {dia}, {mes} e {ano}. Sem ele, a leitura via HTTP fica desligada.
+FEEGOW_GRADE_URL = os.getenv("FEEGOW_GRADE_URL")
+HTTP_POOL_SIZE = max(1, int(os.getenv("HTTP_POOL_SIZE", "10")))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "15"))
+
+_sessao_http = requests.Session()
+_sessao_http.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE))
+_executor_http = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE, thread_name_prefix="http-grade")
+_cookies_validos = False
+
+
+class SessaoExpirada(Exception):
+    """
+    O Feegow respondeu com a tela de login: os cookies copiados do navegador não valem mais.
+    """
+
+
+def atualizar_cookies(cookies: dict):
+    """
+    Copia os cookies autenticados do navegador para a sessão HTTP.
+    """
+    global _cookies_validos
+    # Jar novo trocado numa única atribuição: as threads de leitura em andamento nunca veem a sessão sem cookies
+    _sessao_http.cookies = requests.cookies.cookiejar_from_dict(cookies)
+    _cookies_validos = bool(cookies)
+    print(f"🍪 {len(cookies)} cookie(s) copiados do navegador para a sessão HTTP.")
+
+
+def cookies_validos() -> bool:
+    return _cookies_validos
+
+
+def fast_path_disponivel() -> bool:
+    return bool(FEEGOW_GRADE_URL) and _cookies_validos
+
+
+def _sessao_expirou(resposta: requests.Response) -> bool:
+    if resposta.status_code in (401, 403):
+        return True
+    if "login" in resposta.url.lower():
+        return True
+    return 'id="User"' in resposta.text
+
+
+def buscar_grade_http(data_atual: datetime) -> list[dict]:
+    """
+    Lê a grade de uma data direto do Feegow, sem renderizar nada no navegador.
+    Levanta SessaoExpirada quando é preciso logar de novo pelo Selenium.
+    """
+    global _cookies_validos
+    url = FEEGOW_GRADE_URL.format(
+        data=data_atual.strftime("%d/%m/%Y"),
+        dia=data_atual.strftime("%d"),
+        mes=data_atual.strftime("%m"),
+        ano=data_atual.strftime("%Y"),
+    )
+
+    resposta = _sessao_http.get(url, timeout=HTTP_TIMEOUT)
+    if _sessao_expirou(resposta):
+        _cookies_validos = False
+        raise SessaoExpirada(url)
+    resposta.raise_for_status()
+
+    print(f"⚡ Grade de {data_atual.strftime('%d/%m/%Y')} lida via HTTP.")
+    return parsear_grade_html(resposta.text)
+
+
+async def buscar_grade_http_async(data_atual: datetime) -> list[dict]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor_http, buscar_grade_http, data_atual)
@@ -0,0 +1,164 @@
+# 🗂 Bibliotecas
+from datetime import datetime
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+# 💾 Redis
+from redis.exceptions import RedisError
+from redis_utils import obter_redis
+
+# 📑 Modelos e lifespan
+from code_sup import normalizar_nome
+
+
+logger = logging.getLogger(__name__)
+
+# Um agendamento em andamento não leva mais que isso; passado o prazo, a trava some e outro pode tentar
+TTL_EM_ANDAMENTO = int(os.getenv("TTL_IDEMPOTENCIA_ANDAMENTO", "300"))
+# Por quanto tempo um agendamento concluído é devolvido de novo sem abrir o navegador (segundos).
+# Vale para o header Idempotency-Key: o cliente decide quando um pedido é novo.
+TTL_CONCLUIDO = int(os.getenv("TTL_IDEMPOTENCIA_CONCLUIDO", "86400"))
+# Chave derivada dos dados só cobre a janela de retries: depois dela, o mesmo paciente no mesmo horário
+# (ex.: cancelou por fora e remarcou) é um agendamento novo
+TTL_DERIVADA = int(os.getenv("TTL_IDEMPOTENCIA_DERIVADA", "600"))
+INTERVALO_CONSULTA = 0.5
+
+# Redis fora do ar (ou ainda não iniciado): o agendamento segue sem a proteção entre réplicas
+ERROS_REDIS = (RedisError, RuntimeError)
+
+# Execuções em andamento neste processo: uma repetição simultânea espera a mesma tarefa
+_em_andamento: dict[str, asyncio.Task] = {}
+
+
+def chave_idempotencia(chave: str) -> str:
+    return f"idempotencia:{chave}"
+
+
+def chave_job_idempotente(chave: str) -> str:
+    return f"idempotencia_job:{chave}"
+
+
+def derivar_chave(*campos: str | None) -> str:
+    """
+    Sem o header Idempotency-Key, a chave sai dos próprios dados do agendamento (normalizados),
+    então a repetição de um mesmo pedido cai sempre na mesma chave.
+    """
+    partes = [normalizar_nome(campo or "") for campo in campos]
+    return hashlib.sha256("|".join(partes).encode("utf-8")).hexdigest()
+
+
+async def _ler_registro(chave: str) -> dict | None:
+    valor = await obter_redis().get(chave_idempotencia(chave))
+    return json.loads(valor) if valor else None
+
+
+async def _aguardar_outro_processo(chave: str) -> dict | None:
+    """
+    Outro processo está agendando com a mesma chave: espera o resultado dele.
+    Retorna None se o registro sumir (falhou ou expirou) — aí quem chamou pode tentar de novo.
+    """
+    prazo = time.monotonic() + TTL_EM_ANDAMENTO
+    while time.monotonic() < prazo:
+        registro = await _ler_registro(chave)
+        if registro is None:
+            return None
+        if registro["status"] == "concluido":
+            return registro["resultado"]
+        await asyncio.sleep(INTERVALO_CONSULTA)
+    return None
+
+
+async def _gravar_registro(chave: str, registro: dict | None, ttl: int = TTL_CONCLUIDO):
+    # O agendamento já aconteceu: uma falha do Redis aqui só custa a idempotência, não o resultado
+    try:
+        if registro is None:
+            await obter_redis().delete(chave_idempotencia(chave))
+        else:
+            await obter_redis().set(chave_idempotencia(chave), json.dumps(registro, ensure_ascii=False), ex=ttl)
+    except ERROS_REDIS as e:
+        logger.warning(f"⚠️ Não foi possível registrar o agendamento para repetições ({type(e).__name__})")
+
+
+async def _executar_e_registrar(chave: str, trabalho, sucesso, registrar: bool = True,
+                                ttl: int = TTL_CONCLUIDO) -> dict:
+    try:
+        resultado = await trabalho()
+    except BaseException:
+        if registrar:
+            await _gravar_registro(chave, None)
+        raise
+
+    if not registrar:
+        return resultado
+    if sucesso(resultado):
+        await _gravar_registro(chave, {"status": "concluido", "resultado": resultado,
+                                       "concluido_em": datetime.now().isoformat(timespec="seconds")}, ttl)
+    else:
+        # Falha não fica guardada: a próxima tentativa abre o navegador de novo
+        await _gravar_registro(chave, None)
+    return resultado
+
+
+async def executar_idempotente(chave: str, trabalho, sucesso, ttl: int = TTL_CONCLUIDO) -> dict:
+    """
+    Executa `trabalho` (função async sem argumentos) uma única vez por chave, entre réplicas:
+      - já concluído: devolve o resultado guardado, sem trabalho nenhum;
+      - em andamento neste processo: espera a mesma tarefa;
+      - em andamento em outro processo: espera o registro virar "concluido".
+    Só resultados em que `sucesso(resultado)` é verdadeiro ficam guardados, por `ttl` segundos.
+    Sem Redis, o trabalho roda assim mesmo, deduplicado só dentro do processo.
+    """
+    registrar = True
+    while True:
+        tarefa = _em_andamento.get(chave)
+        if tarefa is not None:
+            print("🔁 Agendamento idêntico já em andamento. Aguardando o mesmo resultado...")
+            return {**await asyncio.shield(tarefa), "reaproveitado": True}
+
+        try:
+            registro = {"status": "em_andamento", "iniciado_em": datetime.now().isoformat(timespec="seconds")}
+            if await obter_redis().set(chave_idempotencia(chave), json.dumps(registro), nx=True,
+                                       ex=TTL_EM_ANDAMENTO):
+                break
+
+            registro = await _ler_registro(chave)
+            if registro and registro["status"] == "concluido":
+                print("♻️ Agendamento já concluído antes. Devolvendo o resultado guardado.")
+                return {**registro["resultado"], "reaproveitado": True}
+
+            if registro:
+                print("⏳ Agendamento idêntico em andamento em outra réplica. Aguardando...")
+                resultado = await _aguardar_outro_processo(chave)
+                if resultado is not None:
+                    return {**resultado, "reaproveitado": True}
+            # O registro sumiu (a outra tentativa falhou ou expirou): tenta pegar a vez de novo
+        except ERROS_REDIS as e:
+            logger.warning(f"⚠️ Redis indisponível, agendando sem idempotência entre réplicas ({type(e).__name__})")
+            registrar = False
+            break
+
+    tarefa = asyncio.create_task(_executar_e_registrar(chave, trabalho, sucesso, registrar, ttl))
+    _em_andamento[chave] = tarefa
+    tarefa.add_done_callback(lambda _: _em_andamento.pop(chave, None))
+    # shield: se o cliente desistir, o agendamento já começado termina e fica registrado para a repetição
+    return await asyncio.shield(tarefa)
+
+
+async def reservar_job(chave: str, job_id: str, ttl: int = TTL_CONCLUIDO) -> str:
+    """
+    Liga a chave a um job: devolve `job_id` se ele é o primeiro, ou o job que já estava ligado a ela.
+    """
+    redis = obter_redis()
+    if await redis.set(chave_job_idempotente(chave), job_id, nx=True, ex=ttl):
+        return job_id
+    return await redis.get(chave_job_idempotente(chave)) or job_id
+
+
+async def substituir_job(chave: str, job_id: str, ttl: int = TTL_CONCLUIDO) -> str:
+    # O job ligado à chave falhou ou expirou: a nova tentativa passa a ser a referência
+    await obter_redis().set(chave_job_idempotente(chave), job_id, ex=ttl)
+    return job_id
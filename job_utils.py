@@ -0,0 +1,128 @@
+# 🗂 Bibliotecas
+from datetime import datetime
+from urllib.parse import urlsplit
+from uuid import uuid4
+import asyncio
+import json
+import logging
+import os
+
+import requests
+
+# 💾 Redis
+from redis_utils import obter_redis
+
+
+logger = logging.getLogger(__name__)
+
+# Por quanto tempo o estado de um job fica consultável depois de criado (segundos)
+JOB_TTL = int(os.getenv("JOB_TTL", "3600"))
+CALLBACK_TIMEOUT = float(os.getenv("CALLBACK_TIMEOUT", "10"))
+# Hosts que podem receber callback (separados por vírgula). Sem nenhum, o callback_url é recusado.
+CALLBACK_HOSTS_PERMITIDOS = {h.strip().lower() for h in os.getenv("CALLBACK_HOSTS_PERMITIDOS", "").split(",") if h.strip()}
+CALLBACK_ESQUEMAS = {e.strip().lower() for e in os.getenv("CALLBACK_ESQUEMAS", "https").split(",") if e.strip()}
+
+# Referências às tarefas em execução neste processo (o event loop só guarda referências fracas)
+_jobs_em_execucao: set[asyncio.Task] = set()
+
+
+def chave_job(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+def _agora() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+async def atualizar_job(job_id: str, **campos):
+    # Valores não textuais (pedido, resultado) vão como JSON; o hash continua legível no redis-cli
+    mapeamento = {
+        campo: valor if isinstance(valor, str) else json.dumps(valor, ensure_ascii=False)
+        for campo, valor in campos.items()
+    }
+    await obter_redis().hset(chave_job(job_id), mapping=mapeamento)
+
+
+async def ler_job(job_id: str) -> dict | None:
+    """
+    Estado do job, de qualquer réplica: status (pendente, em_andamento, concluido, erro), datas e resultado.
+    """
+    dados = await obter_redis().hgetall(chave_job(job_id))
+    if not dados:
+        return None
+    for campo in ("pedido", "resultado"):
+        if campo in dados:
+            dados[campo] = json.loads(dados[campo])
+    return {"job_id": job_id, **dados}
+
+
+def validar_callback_url(callback_url: str) -> str | None:
+    """
+    O servidor faz um POST para essa URL: só esquemas e hosts da lista de permitidos passam,
+    senão qualquer cliente apontaria o callback para a rede interna.
+    Retorna a mensagem de erro, ou None se a URL pode ser usada.
+    """
+    try:
+        partes = urlsplit(callback_url)
+        host = (partes.hostname or "").lower()
+    except ValueError:
+        return "callback_url inválido."
+    if partes.scheme.lower() not in CALLBACK_ESQUEMAS:
+        return f"Esquema não permitido no callback_url: {partes.scheme or '(vazio)'}."
+    if not host or host not in CALLBACK_HOSTS_PERMITIDOS or partes.username or partes.password:
+        return f"Host não permitido no callback_url: {host or '(vazio)'}."
+    return None
+
+
+async def _avisar_callback(job_id: str, callback_url: str):
+    job = await ler_job(job_id)
+    try:
+        resposta = await asyncio.to_thread(requests.post, callback_url, json=job,
+                                           timeout=CALLBACK_TIMEOUT, allow_redirects=False)
+        print(f"📨 Callback do job {job_id} enviado ({resposta.status_code}).")
+    except requests.RequestException as e:
+        logger.warning(f"⚠️ Falha no callback do job {job_id} ({type(e).__name__})")
+
+
+async def _executar_job(job_id: str, trabalho, callback_url: str | None):
+    await atualizar_job(job_id, status="em_andamento", iniciado_em=_agora())
+    try:
+        resultado = await trabalho()
+        await atualizar_job(job_id, status="concluido", concluido_em=_agora(), resultado=resultado)
+        print(f"✅ Job {job_id} concluído.")
+    except Exception as e:
+        logger.error(f"❌ Job {job_id} falhou: {type(e).__name__}")
+        await atualizar_job(job_id, status="erro", concluido_em=_agora(), resultado={"erro": type(e).__name__})
+
+    if callback_url:
+        await _avisar_callback(job_id, callback_url)
+
+
+def novo_job_id() -> str:
+    return uuid4().hex
+
+
+async def iniciar_job(tipo: str, pedido: dict, trabalho, callback_url: str | None = None,
+                      job_id: str | None = None) -> str:
+    """
+    Registra o job no Redis e dispara `trabalho` (uma função async sem argumentos) em segundo plano.
+    Retorna o job_id na hora; o resultado fica em GET /jobs/{job_id} e, se houver, vai para o callback_url.
+    """
+    job_id = job_id or novo_job_id()
+    chave = chave_job(job_id)
+
+    pipe = obter_redis().pipeline(transaction=True)
+    pipe.hset(chave, mapping={
+        "tipo": tipo,
+        "status": "pendente",
+        "criado_em": _agora(),
+        "pedido": json.dumps(pedido, ensure_ascii=False)
+    })
+    pipe.expire(chave, JOB_TTL)
+    await pipe.execute()
+
+    tarefa = asyncio.create_task(_executar_job(job_id, trabalho, callback_url))
+    _jobs_em_execucao.add(tarefa)
+    tarefa.add_done_callback(_jobs_em_execucao.discard)
+    print(f"🧾 Job {job_id} ({tipo}) criado.")
+    return job_id
@@ -0,0 +1,77 @@
+# 🗂 Bibliotecas
+from fastapi import APIRouter, Header
+from fastapi.responses import JSONResponse
+import logging
+
+# 📑 Modelos e lifespan
+from code_sup import RequisicaoHorario, ConfirmacaoAgendamento
+
+# 🔎 Busca de horários
+from find_slot import responder_find_slot
+
+# 📅 Agendamento
+from make_appointment import (responder_make_appointment, chave_do_agendamento, agendamento_registrado,
+                              ttl_do_agendamento)
+
+# 🧾 Jobs
+from job_utils import iniciar_job, ler_job, novo_job_id, validar_callback_url
+
+# 🔁 Idempotência
+from idempotencia_utils import reservar_job, substituir_job
+
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+
+def recusar_callback(callback_url: str | None) -> JSONResponse | None:
+    # Recusado antes de criar o job: nada roda para um callback que não seria enviado
+    erro = validar_callback_url(callback_url) if callback_url else None
+    if erro:
+        logger.warning(f"⚠️ {erro}")
+        return JSONResponse(status_code=400, content={"status": "erro", "mensagem": erro})
+    return None
+
+
+# Modo job: o POST responde na hora com um job_id e o trabalho segue no pool de navegadores.
+# Um timeout do gateway não gera nova busca: o cliente consulta GET /jobs/{job_id} ou recebe no callback_url.
+@router.post("/find_slot/jobs", status_code=202)
+async def find_slot_job(body: RequisicaoHorario, callback_url: str | None = None):
+    if recusa := recusar_callback(callback_url):
+        return recusa
+    job_id = await iniciar_job("find_slot", body.model_dump(), lambda: responder_find_slot(body), callback_url)
+    return {"status": "pendente", "job_id": job_id}
+
+
+@router.post("/make_appointment/jobs", status_code=202)
+async def make_appointment_job(body: ConfirmacaoAgendamento, callback_url: str | None = None,
+                               idempotency_key: str | None = Header(None, alias="Idempotency-Key")):
+    if recusa := recusar_callback(callback_url):
+        return recusa
+
+    # 🔁 A repetição do mesmo agendamento recebe o job que já existe, a menos que ele tenha falhado
+    chave = chave_do_agendamento(body, idempotency_key)
+    ttl = ttl_do_agendamento(idempotency_key)
+    novo_id = novo_job_id()
+    job_id = await reservar_job(chave, novo_id, ttl)
+    if job_id != novo_id:
+        job = await ler_job(job_id)
+        if job and job["status"] != "erro" and (job["status"] != "concluido"
+                                                 or agendamento_registrado(job["resultado"])):
+            print(f"🔁 Agendamento idêntico já tem o job {job_id}.")
+            return {"status": job["status"], "job_id": job_id}
+        job_id = await substituir_job(chave, novo_id, ttl)
+
+    # Dados pessoais (CPF, nascimento, contato) não vão para o Redis
+    pedido = body.model_dump(include={"especialidade", "data", "hora", "nome_profissional", "nome_paciente"})
+    await iniciar_job("make_appointment", pedido, lambda: responder_make_appointment(body, idempotency_key),
+                      callback_url, job_id)
+    return {"status": "pendente", "job_id": job_id}
+
+
+@router.get("/jobs/{job_id}")
+async def consultar_job(job_id: str):
+    job = await ler_job(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"status": "erro", "mensagem": "Job não encontrado ou expirado."})
+    return job
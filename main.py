@@ -1,6 +1,7 @@
 # 🗂 Bibliotecas
 import os
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
@@ -8,13 +9,18 @@ import logging
 
 # 🧭 Rotas
 from find_slot import router as slot_finder
+from find_slot_batch import router as slot_finder_batch
 from make_appointment import router as appointment_maker
+from jobs import router as jobs
 # from amb_test import router as test
 # from cancel_appointment import router as appointment_cancelation
 
 # 📑 Modelos e lifespan
 from code_sup import lifespan
 
+# 🧭 Navegador
+from driver_utils import driver_pool
+
 
 logging.basicConfig(level=logging.WARNING)
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
@@ -43,7 +49,9 @@ app = FastAPI(
 
 # Registrando as rotas
 app.include_router(slot_finder, prefix="/amor-saude")
+app.include_router(slot_finder_batch, prefix="/amor-saude")
 app.include_router(appointment_maker, prefix="/amor-saude")
+app.include_router(jobs, prefix="/amor-saude")
 # app.include_router(test, prefix="/amor-saude")
 # app.include_router(appointment_cancelation, prefix="/amor-saude")
 
@@ -52,6 +60,20 @@ app.include_router(appointment_maker, prefix="/amor-saude")
 async def ping():
     return {"status": "ok"}
 
+
+@app.get("/ready")
+async def ready():
+    # Diferente do /ping: só responde 200 com ao menos uma sessão logada (no aquecimento ou, se ele
+    # falhou no boot, na primeira vez que um request logar sob demanda)
+    if not driver_pool.pronto:
+        return JSONResponse(status_code=503, content={"status": "aquecendo", **driver_pool.estatisticas()})
+    return {"status": "pronto"}
+
+
+@app.get("/pool")
+async def pool():
+    return driver_pool.estatisticas()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
@@ -1,5 +1,5 @@
 # 🗂 Bibliotecas
-from fastapi import APIRouter
+from fastapi import APIRouter, Header
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
@@ -15,19 +15,19 @@ from code_sup import ConfirmacaoAgendamento
 from date_times import navegar_para_data
 
 # 🧭 Navegador
-from driver_utils import get_driver, driver_lock
-
-# 🔐 Sessão e login
-from auth_utils import sessao_ja_logada, fazer_login
+from driver_utils import driver_pool, preparar_sessao, marcar_sessao_suja, PRIORIDADE_AGENDAMENTO
 
 # 📅 Agendamento
-from booking import (buscar_bloco_do_profissional, preencher_paciente, salvar_agendamento,
+from booking import (buscar_bloco_do_profissional, indexar_blocos, preencher_paciente, salvar_agendamento,
                      cadastrar_paciente, confirmar_agendado)
 # extrair_consultorio_do_bloco,,
 
 # 📑 Modelos e lifespan
 from code_sup import print_caixa
 
+# 🔁 Idempotência
+from idempotencia_utils import executar_idempotente, derivar_chave, TTL_CONCLUIDO, TTL_DERIVADA
+
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -36,125 +36,181 @@ router = APIRouter()
 
 async def agendar_horario(nome_medico: str, especialidade: str, data: str, hora: str, nome_paciente: str,
                           cpf: str, data_nascimento: str, contato: str, matricula: Optional[str] = None):
-    async with driver_lock:
-        driver = get_driver()
-        wait = WebDriverWait(driver, 20)
+    # Agendamento passa na frente de qualquer leitura na fila do navegador
+    async with driver_pool.sessao(PRIORIDADE_AGENDAMENTO) as sessao:
+        try:
+            dados = await sessao.executar(_agendar_horario, nome_medico, especialidade, data, hora, nome_paciente,
+                                          cpf, data_nascimento, contato, matricula)
+        except Exception:
+            marcar_sessao_suja(sessao.driver)
+            raise
+        # Um agendamento que falhou pode deixar modal ou formulário abertos na página
+        if not dados or "erro" in dados:
+            marcar_sessao_suja(sessao.driver)
+        return dados
+
 
-        agendando = {
-            "Paciente": nome_paciente,
-            "Especialidade": especialidade,
-            "Médico": nome_medico,
-            "Data": data,
-            "Horário": hora
-        }
+def _agendar_horario(driver, nome_medico: str, especialidade: str, data: str, hora: str, nome_paciente: str,
+                     cpf: str, data_nascimento: str, contato: str, matricula: Optional[str] = None):
+    # Roda na thread da sessão do navegador: chamadas bloqueantes não travam o event loop
+    wait = WebDriverWait(driver, 20)
 
-        agendar = print_caixa("Agendando horário", agendando)
-        print(agendar)
+    agendando = {
+        "Paciente": nome_paciente,
+        "Especialidade": especialidade,
+        "Médico": nome_medico,
+        "Data": data,
+        "Horário": hora
+    }
 
-        print("\n🧭 Acessando AmorSaúde...")
+    agendar = print_caixa("Agendando horário", agendando)
+    print(agendar)
+
+    print("\n🧭 Acessando AmorSaúde...")
+
+    # Valida e converte data para datetime
+    try:
+        data_dt = datetime.strptime(data, "%d/%m/%Y")
+    except ValueError as e:
+        logger.warning(f"⚠️ Data inválida: {data} ({type(e).__name__})")
+        return {"erro": "⚠️ Data em formato inválido."}
+
+    # Depois do "Salvar" o horário pode já estar ocupado no sistema: a partir daí, nenhuma falha vira "tente de novo"
+    salvo = {
+        "especialidade": especialidade,
+        "nome_medico": nome_medico,
+        "data": data,
+        "hora": hora,
+        "paciente": nome_paciente,
+        "status": "salvo_nao_confirmado",
+        "erro": "Agendamento salvo, mas não apareceu na agenda. Verifique no sistema antes de tentar de novo."
+    }
+    salvou = False
 
-        # Valida e converte data para datetime
-        try:
-            data_dt = datetime.strptime(data, "%d/%m/%Y")
-        except ValueError as e:
-            logger.warning(f"⚠️ Data inválida: {data} ({type(e).__name__})")
-            return {"erro": "⚠️ Data em formato inválido."}
+    try:
+        preparar_sessao(driver, wait)
+        first_login = True
+
+        disp = False
+        if not navegar_para_data(driver, wait, data_dt, first_login, disp):
+            print("⛔ Falha ao navegar para a data desejada.")
+            return None
 
         try:
-            driver.get("https://amor-saude.feegow.com/pre-v7.6/?P=AgendaMultipla&Pers=1")
-
-            if not sessao_ja_logada(driver):
-                print("🔐 Sessão não ativa. Realizando login...")
-                first_login = True
-                fazer_login(driver, wait)
-            else:
-                print("🔓 Sessão já autenticada.")
-                first_login = True
-
-            disp = False
-            if not navegar_para_data(driver, wait, data_dt, first_login, disp):
-                print("⛔ Falha ao navegar para a data desejada.")
-                return None
-
-            try:
-                wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "table.table-hover")))
-                print("✅ Tabela de horários apareceu.\n")
-            except TimeoutException:
-                logger.warning("⛔ Tabela não apareceu após seleção. Pulando para próxima data.")
-
-            # Garante visibilidade da grade
-            driver.execute_script("""
-                                        const el = document.getElementById('contQuadro');
-                                        if (el) {
-                                            el.scrollLeft = el.scrollWidth;
-                                        }
-                                    """)
-
-            blocos = driver.find_elements(By.CSS_SELECTOR, "td[id^='pf']")
-            bloco_desejado = buscar_bloco_do_profissional(driver, blocos, nome_medico, especialidade)
-
-
-            if not bloco_desejado:
-                logger.warning("⛔ Horário desejado com o profissional especificado não encontrado.")
-                return {"erro": "Horário desejado com o profissional especificado não encontrado."}
-
-            # Clica no botão correspondente ao horário
-            try:
-                tr_horario = bloco_desejado.find_element(By.CSS_SELECTOR, f"tr[data-hora='{hora}']")
-                botao = tr_horario.find_element(By.CSS_SELECTOR, "button.btn-info")
-                driver.execute_script("arguments[0].scrollIntoView(true);", botao)
-                botao.click()
-                print(f"\n✅ Clicado no horário {hora} com {nome_medico}")
-            except Exception as e:
-                logger.warning(f"❌ Erro ao localizar/clicar no botão do horário ({type(e).__name__})")
-                return { "erro": "❌ Erro ao localizar/clicar no botão do horário"}
-
-            # print(f"Teste com: {especialidade}, {nome_medico}, {data}, {hora}, {nome_paciente}, {solicitante_id}, {data_nascimento}, "
-            #       f"{cpf}, {contato}.")
-
-            preenchido = preencher_paciente(driver, wait, cpf, matricula, data_nascimento, contato)
-
-            if preenchido is False:
-                return {"erro": "Não foi possível preencher os dados obrigatórios do paciente ou o paciente não "
-                                "está cadastrado e não tem matricula."}
-
-            else:
-                if not preenchido:
-                    print("⚠️ Tentando cadastrar o paciente...")
-
-                    if not cadastrar_paciente(driver, wait, nome_paciente, cpf):
-                        return {"erro": "Paciente não encontrado e não foi possível cadastrá-lo."}
-
-                    wait.until(EC.invisibility_of_element_located((By.CLASS_NAME, "modal-content")))
-                    print("✅ Modal de cadastro fechado.")
-
-                    if not preencher_paciente(driver, wait, cpf, matricula, data_nascimento, contato):
-                        return {"erro": "Paciente foi cadastrado, mas não pôde ser selecionado."}
-
-
-                if not salvar_agendamento(driver, wait):
-                    return {"erro": "Não foi possível confirmar o agendamento."}
-
-                # TODO CORRIGIR ESSA PARTE
-                if not confirmar_agendado(driver, wait, nome_paciente, nome_medico, hora, especialidade):
-                    return {"erro": "Horário agendado não foi encontrado."}
-
-                return {
-                    "especialidade": especialidade,
-                    "nome_medico": nome_medico,
-                    "data": data,
-                    "hora": hora,
-                    "paciente": nome_paciente,
-                    "status": "Agendamento concluído com sucesso"
-                }
+            wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "table.table-hover")))
+            print("✅ Tabela de horários apareceu.\n")
+        except TimeoutException:
+            logger.warning("⛔ Tabela não apareceu após seleção. Pulando para próxima data.")
 
+        # Garante visibilidade da grade
+        driver.execute_script("""
+                                    const el = document.getElementById('contQuadro');
+                                    if (el) {
+                                        el.scrollLeft = el.scrollWidth;
+                                    }
+                                """)
+
+        # 🗂️ Uma passada pela grade; o mesmo índice serve para achar o bloco de novo na confirmação
+        indice_blocos = indexar_blocos(driver)
+        bloco_desejado = buscar_bloco_do_profissional(driver, nome_medico, especialidade, indice_blocos)
+
+
+        if not bloco_desejado:
+            logger.warning("⛔ Horário desejado com o profissional especificado não encontrado.")
+            return {"erro": "Horário desejado com o profissional especificado não encontrado."}
+
+        # Clica no botão correspondente ao horário
+        try:
+            tr_horario = bloco_desejado.find_element(By.CSS_SELECTOR, f"tr[data-hora='{hora}']")
+            botao = tr_horario.find_element(By.CSS_SELECTOR, "button.btn-info")
+            driver.execute_script("arguments[0].scrollIntoView(true);", botao)
+            botao.click()
+            print(f"\n✅ Clicado no horário {hora} com {nome_medico}")
         except Exception as e:
-            logger.exception(f"❌ Erro inesperado durante o processo de agendamento ({type(e).__name__})")
-            return None
+            logger.warning(f"❌ Erro ao localizar/clicar no botão do horário ({type(e).__name__})")
+            return { "erro": "❌ Erro ao localizar/clicar no botão do horário"}
+
+        # print(f"Teste com: {especialidade}, {nome_medico}, {data}, {hora}, {nome_paciente}, {solicitante_id}, {data_nascimento}, "
+        #       f"{cpf}, {contato}.")
+
+        preenchido = preencher_paciente(driver, wait, cpf, matricula, data_nascimento, contato)
+
+        if preenchido is False:
+            return {"erro": "Não foi possível preencher os dados obrigatórios do paciente ou o paciente não "
+                            "está cadastrado e não tem matricula."}
+
+        else:
+            if not preenchido:
+                print("⚠️ Tentando cadastrar o paciente...")
+
+                if not cadastrar_paciente(driver, wait, nome_paciente, cpf):
+                    return {"erro": "Paciente não encontrado e não foi possível cadastrá-lo."}
+
+                wait.until(EC.invisibility_of_element_located((By.CLASS_NAME, "modal-content")))
+                print("✅ Modal de cadastro fechado.")
+
+                if not preencher_paciente(driver, wait, cpf, matricula, data_nascimento, contato):
+                    return {"erro": "Paciente foi cadastrado, mas não pôde ser selecionado."}
+
+
+            if not salvar_agendamento(driver, wait):
+                return {"erro": "Não foi possível confirmar o agendamento."}
+            salvou = True
+
+            # TODO CORRIGIR ESSA PARTE
+            if not confirmar_agendado(driver, wait, nome_paciente, nome_medico, hora, especialidade,
+                                      indice_blocos):
+                print("⚠️ Agendamento salvo, mas não encontrado na agenda.")
+                return salvo
+
+            return {
+                "especialidade": especialidade,
+                "nome_medico": nome_medico,
+                "data": data,
+                "hora": hora,
+                "paciente": nome_paciente,
+                "status": "Agendamento concluído com sucesso"
+            }
+
+    except Exception as e:
+        logger.exception(f"❌ Erro inesperado durante o processo de agendamento ({type(e).__name__})")
+        return salvo if salvou else None
 
 
 @router.post("/make_appointment")
-async def make_appointment(body: ConfirmacaoAgendamento):
+async def make_appointment(body: ConfirmacaoAgendamento,
+                           idempotency_key: str | None = Header(None, alias="Idempotency-Key")):
+    return await responder_make_appointment(body, idempotency_key)
+
+
+def chave_do_agendamento(body: ConfirmacaoAgendamento, idempotency_key: str | None = None) -> str:
+    # Sem header, o mesmo paciente no mesmo horário com o mesmo profissional é o mesmo agendamento
+    return idempotency_key or derivar_chave(body.especialidade, body.data, body.hora, body.nome_profissional,
+                                            "".join(filter(str.isdigit, body.CPF)))
+
+
+def ttl_do_agendamento(idempotency_key: str | None = None) -> int:
+    # Sem header, a chave derivada só protege contra retries; com header, vale o prazo longo
+    return TTL_CONCLUIDO if idempotency_key else TTL_DERIVADA
+
+
+def agendamento_registrado(resultado: dict) -> bool:
+    # Salvo sem confirmação também fica guardado: repetir abriria o navegador e agendaria duas vezes
+    return resultado.get("status") in ("confirmado", "salvo_nao_confirmado")
+
+
+async def responder_make_appointment(body: ConfirmacaoAgendamento, idempotency_key: str | None = None) -> dict:
+    """
+    Corpo do /make_appointment, reaproveitado pelo modo job (jobs.py).
+    Uma repetição do mesmo agendamento (timeout do cliente, retry do gateway) não abre o navegador de novo:
+    espera a execução em andamento ou recebe o resultado guardado — inclusive um "salvo_nao_confirmado".
+    """
+    return await executar_idempotente(chave_do_agendamento(body, idempotency_key),
+                                      lambda: _responder_make_appointment(body), agendamento_registrado,
+                                      ttl_do_agendamento(idempotency_key))
+
+
+async def _responder_make_appointment(body: ConfirmacaoAgendamento) -> dict:
     dados = await agendar_horario(
         especialidade=body.especialidade,
         nome_medico=body.nome_profissional,
@@ -0,0 +1,98 @@
+"""
+Migra os horários oferecidos do layout antigo para o compacto e compara o uso de memória.
+
+Antes: uma string JSON por oferta, em agendamento:<usuario>:<especialidade>:<data>:<hora>:<medico>, com TTL de 24 h.
+Depois: um hash ofertas:<especialidade>:<data> com um campo <usuario>|<hora>|<medico> por oferta,
+expirando no fim da data (redis_utils.expiracao_da_data).
+
+Uso:
+    REDIS_URL=redis://... python migrar_redis.py            # migra e remove as chaves antigas
+    REDIS_URL=redis://... python migrar_redis.py --manter   # migra e mantém as chaves antigas
+"""
+# 🗂 Bibliotecas
+import asyncio
+import json
+import sys
+import time
+
+# 💾 Redis
+from redis_utils import (iniciar_redis, fechar_redis, obter_redis, chave_ofertas, campo_oferta, valor_oferta,
+                         expiracao_da_data)
+
+
+PADRAO_LEGADO = "agendamento:*"
+LOTE = 500
+
+
+async def _memoria(chaves: list[str]) -> int:
+    if not chaves:
+        return 0
+    pipe = obter_redis().pipeline(transaction=False)
+    for chave in chaves:
+        pipe.memory_usage(chave, samples=0)
+    return sum(uso or 0 for uso in await pipe.execute())
+
+
+async def migrar(manter: bool = False):
+    redis = obter_redis()
+    agora = int(time.time())
+
+    chaves_legadas = [chave async for chave in redis.scan_iter(match=PADRAO_LEGADO, count=LOTE)]
+    print(f"🔎 {len(chaves_legadas)} chave(s) no layout antigo.")
+    memoria_antes = await _memoria(chaves_legadas)
+
+    migradas, expiradas, invalidas = 0, 0, 0
+    hashes: set[str] = set()
+
+    for inicio in range(0, len(chaves_legadas), LOTE):
+        lote = chaves_legadas[inicio:inicio + LOTE]
+        valores = await redis.mget(lote)
+
+        pipe = redis.pipeline(transaction=False)
+        for valor in valores:
+            try:
+                dados = json.loads(valor) if valor else None
+                expira_em = expiracao_da_data(dados["data"])
+                chave = chave_ofertas(dados["especialidade"], dados["data"])
+                campo = campo_oferta(dados["usuario_id"], dados["hora"], dados["medico_nome"])
+            except (ValueError, KeyError, TypeError):
+                invalidas += 1
+                continue
+
+            # Ofertas de datas que já passaram simplesmente não são migradas
+            if expira_em <= agora:
+                expiradas += 1
+                continue
+
+            pipe.hset(chave, campo, valor_oferta(dados["medico_nome"], dados.get("consultorio", ""),
+                                                 dados.get("registrado_em", "")))
+            pipe.expireat(chave, expira_em)
+            hashes.add(chave)
+            migradas += 1
+
+        if not manter:
+            pipe.delete(*lote)
+        await pipe.execute()
+
+    memoria_depois = await _memoria(sorted(hashes))
+
+    print(f"✅ Migradas: {migradas} | Datas passadas descartadas: {expiradas} | Inválidas: {invalidas}")
+    print(f"🗃️ {len(hashes)} hash(es) ofertas:* criados/atualizados.")
+    print(f"📏 Memória (MEMORY USAGE): antes {memoria_antes} bytes em {len(chaves_legadas)} chave(s); "
+          f"depois {memoria_depois} bytes em {len(hashes)} hash(es).")
+    if memoria_antes:
+        print(f"📉 Redução: {100 * (1 - memoria_depois / memoria_antes):.1f}%")
+    if manter:
+        print("ℹ️ Chaves antigas mantidas (--manter); expiram sozinhas pelo TTL de 24 h.")
+
+
+async def main():
+    await iniciar_redis()
+    try:
+        await migrar(manter="--manter" in sys.argv[1:])
+    finally:
+        await fechar_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
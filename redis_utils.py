@@ -1,65 +1,270 @@
 # 🗂 Bibliotecas
 import json
 import os
-import re
-from redis import from_url
-from datetime import datetime
+import asyncio
+from redis import asyncio as aioredis
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 
 # 📑 Modelos e lifespan
 from code_sup import normalizar_nome
 
 REDIS_URL = os.getenv("REDIS_URL")
-redis_client = from_url(REDIS_URL, decode_responses=True)
+# Tamanho do pool de conexões compartilhado e timeouts (segundos)
+REDIS_MAX_CONEXOES = int(os.getenv("REDIS_MAX_CONEXOES", "20"))
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "5"))
 
+_redis: aioredis.Redis | None = None
+_loop: asyncio.AbstractEventLoop | None = None
 
-def registrar_agendamento(usuario_id: str, especialidade: str, data: str, hora: str, medico_nome: str, consultorio: str, ttl: int = 86400):
-    nome_normalizado = normalizar_nome(medico_nome)
-    chave = f"agendamento:{usuario_id}:{especialidade.lower()}:{data}:{hora}:{nome_normalizado}"
 
-    dados = {
-        "especialidade": especialidade,
-        "data": data,
-        "hora": hora,
-        "usuario_id": usuario_id,
-        "medico_nome": medico_nome,
-        "consultorio": consultorio,
-        "registrado_em": datetime.now().isoformat()
+async def iniciar_redis():
+    """
+    Cria o cliente assíncrono com um pool de conexões de tamanho fixo. Chamado no lifespan.
+    """
+    global _redis, _loop
+    pool = aioredis.BlockingConnectionPool.from_url(
+        REDIS_URL,
+        decode_responses=True,
+        max_connections=REDIS_MAX_CONEXOES,
+        timeout=REDIS_TIMEOUT,  # espera máxima por uma conexão livre do pool
+        socket_timeout=REDIS_TIMEOUT,
+        socket_connect_timeout=REDIS_TIMEOUT,
+        health_check_interval=30,
+    )
+    _redis = aioredis.Redis(connection_pool=pool)
+    _loop = asyncio.get_running_loop()
+    print(f"💾 Redis conectado (pool de {REDIS_MAX_CONEXOES} conexões).")
+
+
+async def fechar_redis():
+    global _redis, _loop
+    if _redis is not None:
+        await _redis.aclose()
+        await _redis.connection_pool.disconnect()
+    _redis = None
+    _loop = None
+
+
+def obter_redis() -> aioredis.Redis:
+    if _redis is None:
+        raise RuntimeError("Redis não inicializado: iniciar_redis() precisa rodar no lifespan.")
+    return _redis
+
+
+def _sincrono(corrotina):
+    """
+    Executa uma corrotina do cliente assíncrono a partir de uma thread fora do event loop
+    (ex.: a thread de uma sessão do navegador) e devolve o resultado.
+    """
+    try:
+        loop_atual = asyncio.get_running_loop()
+    except RuntimeError:
+        loop_atual = None
+
+    if _loop is None or loop_atual is _loop:
+        corrotina.close()
+        if _loop is None:
+            raise RuntimeError("Redis não inicializado: iniciar_redis() precisa rodar no lifespan.")
+        raise RuntimeError("Dentro do event loop, use a versão assíncrona (sufixo _async).")
+
+    return asyncio.run_coroutine_threadsafe(corrotina, _loop).result(timeout=REDIS_TIMEOUT * 2)
+
+
+# 🗃️ Horários oferecidos: um hash por (especialidade, data), com um campo "usuario|hora|medico" por oferta.
+# O hash expira quando a data termina (mais MARGEM_EXPIRACAO), não 24 h depois de cada registro.
+MARGEM_EXPIRACAO = int(os.getenv("MARGEM_EXPIRACAO", "3600"))
+FUSO = ZoneInfo("America/Sao_Paulo")
+
+
+def chave_ofertas(especialidade: str, data: str) -> str:
+    return f"ofertas:{especialidade.lower()}:{data}"
+
+
+def campo_oferta(usuario_id: str, hora: str, medico_nome: str) -> str:
+    return f"{usuario_id}|{hora}|{normalizar_nome(medico_nome)}"
+
+
+def horario_do_slot(data: str, hora: str) -> datetime:
+    return datetime.strptime(f"{data} {hora}", "%d/%m/%Y %H:%M").replace(tzinfo=FUSO)
+
+
+def expiracao_da_data(data: str) -> int:
+    """
+    Timestamp em que os registros da data deixam de importar: o fim do dia, mais a margem.
+    """
+    fim_do_dia = datetime.strptime(data, "%d/%m/%Y").replace(tzinfo=FUSO) + timedelta(days=1)
+    return int(fim_do_dia.timestamp()) + MARGEM_EXPIRACAO
+
+
+def valor_oferta(medico_nome: str, consultorio: str, registrado_em: str) -> str:
+    # Especialidade, data, hora e usuário já estão na chave e no campo: só guarda o resto
+    return json.dumps({"medico_nome": medico_nome, "consultorio": consultorio, "registrado_em": registrado_em},
+                      ensure_ascii=False, separators=(",", ":"))
+
+
+async def registrar_agendamento_async(usuario_id: str, especialidade: str, data: str, hora: str, medico_nome: str,
+                                      consultorio: str):
+    await registrar_agendamentos_async(usuario_id, especialidade, data, [(hora, medico_nome, consultorio)])
+
+
+async def ja_foi_enviado_async(usuario_id: str, especialidade: str, data: str, horario: str, medico_nome: str) -> bool:
+    # Chave e campo são determinísticos: um HEXISTS, sem varrer os registros dos outros pacientes
+    return bool(await obter_redis().hexists(chave_ofertas(especialidade, data),
+                                            campo_oferta(usuario_id, horario, medico_nome)))
+
+
+async def horarios_ja_enviados_async(usuario_id: str, especialidade: str, data: str,
+                                     horarios: list[tuple[str, str]]) -> set[tuple[str, str]]:
+    """
+    Versão em lote do ja_foi_enviado: recebe (hora, medico) de uma data e devolve os que já foram
+    oferecidos ao usuário, com um único HMGET.
+    """
+    if not horarios:
+        return set()
+
+    campos = [campo_oferta(usuario_id, hora, medico_nome) for hora, medico_nome in horarios]
+    valores = await obter_redis().hmget(chave_ofertas(especialidade, data), campos)
+    return {horario for horario, valor in zip(horarios, valores) if valor is not None}
+
+
+async def registrar_agendamentos_async(usuario_id: str, especialidade: str, data: str,
+                                       horarios: list[tuple[str, str, str]]):
+    """
+    Versão em lote do registrar_agendamento: recebe (hora, medico, consultorio) de uma data.
+    """
+    if not horarios:
+        return
+
+    registrado_em = datetime.now().isoformat(timespec="seconds")
+    chave = chave_ofertas(especialidade, data)
+    campos = {
+        campo_oferta(usuario_id, hora, medico_nome): valor_oferta(medico_nome, consultorio, registrado_em)
+        for hora, medico_nome, consultorio in horarios
     }
 
-    # ⏱ Define o tempo de expiração como 24 horas (em segundos)
-    redis_client.setex(chave, ttl, json.dumps(dados))
-    print(f"\n💾 Horário disponível armazenado no Redis")
+    pipe = obter_redis().pipeline(transaction=True)
+    pipe.hset(chave, mapping=campos)
+    pipe.expireat(chave, expiracao_da_data(data))
+    await pipe.execute()
+    print(f"\n💾 {len(horarios)} horário(s) disponível(is) armazenado(s) no Redis")
 
 
-def ja_foi_enviado(usuario_id: str, especialidade: str, data: str, horario: str, medico_nome: str) -> bool:
-    # Normaliza os dados de entrada para garantir consistência
-    nome_normalizado = normalizar_nome(medico_nome)
-    especialidade = especialidade.lower()
+# 🔒 Reserva atômica por horário (não por usuário): só um paciente recebe cada (data, hora, médico)
+TTL_RESERVA = int(os.getenv("TTL_RESERVA", "1800"))
+
+# Libera a reserva (ou trava) apenas se ela ainda pertence a quem a fez
+SCRIPT_LIBERAR = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+# Renova o TTL da trava apenas se ela ainda pertence a quem a fez
+SCRIPT_RENOVAR = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def chave_reserva(especialidade: str, data: str, hora: str, medico_nome: str) -> str:
+    return f"reserva:{especialidade.lower()}:{data}:{hora}:{normalizar_nome(medico_nome)}"
+
+
+def chave_reservas_do_usuario(usuario_id: str, especialidade: str) -> str:
+    # Conjunto com as chaves de reserva do usuário na especialidade, para liberá-las quando ele pedir de novo nela
+    return f"reservas_usuario:{usuario_id}:{especialidade.lower()}"
+
+
+async def reservar_horario_async(usuario_id: str, especialidade: str, data: str, hora: str, medico_nome: str,
+                                 ttl: int = TTL_RESERVA) -> bool:
+    """
+    Tenta reservar o horário para o usuário (SET NX com TTL). Retorna False se outro já o reservou.
+    """
+    chave = chave_reserva(especialidade, data, hora, medico_nome)
+    # A reserva nunca sobrevive ao próprio horário
+    ate_o_horario = int((horario_do_slot(data, hora) - datetime.now(FUSO)).total_seconds())
+    ttl = max(60, min(ttl, ate_o_horario))
+    redis = obter_redis()
+    if not await redis.set(chave, usuario_id, nx=True, ex=ttl):
+        return False
+
+    pipe = redis.pipeline(transaction=False)
+    pipe.sadd(chave_reservas_do_usuario(usuario_id, especialidade), chave)
+    pipe.expire(chave_reservas_do_usuario(usuario_id, especialidade), TTL_RESERVA)
+    await pipe.execute()
+    return True
+
+
+async def reservados_por_outros_async(usuario_id: str, especialidade: str, data: str,
+                                      horarios: list[tuple[str, str]]) -> set[tuple[str, str]]:
+    """
+    Recebe (hora, medico) de uma data e devolve, com um único MGET, os que estão reservados para outro usuário.
+    """
+    if not horarios:
+        return set()
+
+    donos = await obter_redis().mget([chave_reserva(especialidade, data, hora, medico) for hora, medico in horarios])
+    return {horario for horario, dono in zip(horarios, donos) if dono is not None and dono != usuario_id}
 
-    # Define o padrão para extrair os elementos da chave
-    padrao = r"^agendamento:(.*?):(.*?):(.*?):(.*?):(.*?)$"
 
-    # Recupera todas as chaves no Redis relacionadas a agendamentos
-    chaves = redis_client.keys("agendamento:*")
+async def liberar_reserva_async(usuario_id: str, especialidade: str, data: str, hora: str, medico_nome: str) -> bool:
+    chave = chave_reserva(especialidade, data, hora, medico_nome)
+    redis = obter_redis()
+    await redis.srem(chave_reservas_do_usuario(usuario_id, especialidade), chave)
+    return bool(await redis.eval(SCRIPT_LIBERAR, 1, chave, usuario_id))
 
+
+async def liberar_reservas_do_usuario_async(usuario_id: str, especialidade: str) -> int:
+    """
+    Libera as reservas ainda em nome do usuário na especialidade (ex.: ele recusou os horários oferecidos
+    e pediu de novo). As de outras especialidades continuam valendo: ele pode estar agendando as duas.
+    Retorna quantas foram liberadas. Os horários continuam registrados como já enviados para ele.
+    """
+    redis = obter_redis()
+    chaves = await redis.smembers(chave_reservas_do_usuario(usuario_id, especialidade))
+    if not chaves:
+        return 0
+
+    pipe = redis.pipeline(transaction=False)
     for chave in chaves:
-        # Extrai os componentes da chave usando regex
-        match = re.match(padrao, chave)
-        if match:
-            chave_usuario_id, chave_especialidade, chave_data, chave_horario, chave_nome_normalizado = match.groups()
-
-            # Verifica os critérios individualmente
-            if (
-                    chave_usuario_id == usuario_id and
-                    chave_especialidade == especialidade and
-                    chave_data == data and
-                    chave_horario == horario and
-                    chave_nome_normalizado == nome_normalizado
-            ):
-                # O agendamento já foi enviado
-                return True
-
-    # Se não encontrou nenhum registro correspondente, retorna False
-    return False
+        pipe.eval(SCRIPT_LIBERAR, 1, chave, usuario_id)
+    pipe.delete(chave_reservas_do_usuario(usuario_id, especialidade))
+    liberadas = sum(1 for resultado in (await pipe.execute())[:-1] if resultado)
+    if liberadas:
+        print(f"🔓 {liberadas} reserva(s) anterior(es) de {usuario_id} em {especialidade} liberada(s).")
+    return liberadas
+
+
+# 🔁 Versões síncronas: finas camadas sobre o cliente assíncrono, para código que roda fora do event loop
+
+def registrar_agendamento(usuario_id: str, especialidade: str, data: str, hora: str, medico_nome: str,
+                          consultorio: str):
+    return _sincrono(registrar_agendamento_async(usuario_id, especialidade, data, hora, medico_nome, consultorio))
+
+
+def ja_foi_enviado(usuario_id: str, especialidade: str, data: str, horario: str, medico_nome: str) -> bool:
+    return _sincrono(ja_foi_enviado_async(usuario_id, especialidade, data, horario, medico_nome))
+
+
+def horarios_ja_enviados(usuario_id: str, especialidade: str, data: str,
+                         horarios: list[tuple[str, str]]) -> set[tuple[str, str]]:
+    return _sincrono(horarios_ja_enviados_async(usuario_id, especialidade, data, horarios))
+
+
+def registrar_agendamentos(usuario_id: str, especialidade: str, data: str,
+                           horarios: list[tuple[str, str, str]]):
+    return _sincrono(registrar_agendamentos_async(usuario_id, especialidade, data, horarios))
+
+
+def reservar_horario(usuario_id: str, especialidade: str, data: str, hora: str, medico_nome: str,
+                     ttl: int = TTL_RESERVA) -> bool:
+    return _sincrono(reservar_horario_async(usuario_id, especialidade, data, hora, medico_nome, ttl))
 
 
+def liberar_reserva(usuario_id: str, especialidade: str, data: str, hora: str, medico_nome: str) -> bool:
+    return _sincrono(liberar_reserva_async(usuario_id, especialidade, data, hora, medico_nome))
@@ -0,0 +1,77 @@
+# 🗂 Bibliotecas
+from selenium.webdriver.support.wait import WebDriverWait
+from selenium.common.exceptions import TimeoutException
+from contextlib import contextmanager
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+# ⏱ Limite máximo de qualquer espera (segundos) e intervalo entre verificações
+LIMITE_ESPERA = float(os.getenv("LIMITE_ESPERA", "10"))
+INTERVALO_ESPERA = 0.1
+# Tempo sem novas mutações para considerar a região estável (ms)
+QUIETUDE_MS = int(os.getenv("QUIETUDE_MS", "150"))
+
+
+SCRIPT_AJAX_OCIOSO = """
+return document.readyState === 'complete' && (!window.jQuery || window.jQuery.active === 0);
+"""
+
+SCRIPT_OBSERVAR = """
+const alvo = document.querySelector(arguments[0]) || document.body;
+if (window.__amorObservador) {
+    window.__amorObservador.disconnect();
+}
+window.__amorAlvo = alvo;
+window.__amorMudou = false;
+window.__amorUltimaMudanca = 0;
+window.__amorObservador = new MutationObserver(() => {
+    window.__amorMudou = true;
+    window.__amorUltimaMudanca = performance.now();
+});
+window.__amorObservador.observe(alvo, {childList: true, subtree: true, characterData: true, attributes: true});
+"""
+
+SCRIPT_MUDOU = """
+const quietude = arguments[0];
+const substituido = window.__amorAlvo && !document.contains(window.__amorAlvo);
+const mudou = window.__amorMudou === true || substituido;
+const estavel = substituido || performance.now() - window.__amorUltimaMudanca >= quietude;
+const ocioso = document.readyState === 'complete' && (!window.jQuery || window.jQuery.active === 0);
+return mudou && estavel && ocioso;
+"""
+
+
+def aguardar_ajax_ocioso(driver, limite: float = LIMITE_ESPERA) -> bool:
+    """
+    Retorna assim que a página terminou de carregar e não há requisições jQuery pendentes.
+    """
+    try:
+        WebDriverWait(driver, limite, poll_frequency=INTERVALO_ESPERA).until(
+            lambda d: d.execute_script(SCRIPT_AJAX_OCIOSO)
+        )
+        return True
+    except TimeoutException:
+        logger.warning(f"⚠️ Página ainda ocupada após {limite}s.")
+        return False
+
+
+@contextmanager
+def aguardar_mudanca(driver, seletor: str, limite: float = LIMITE_ESPERA):
+    """
+    Observa a região `seletor` com um MutationObserver, executa o bloco (ex.: um clique) e
+    só sai quando a região mudou, ficou estável e o AJAX terminou — ou quando estoura o limite.
+
+        with aguardar_mudanca(driver, "#contQuadro"):
+            botao.click()
+    """
+    driver.execute_script(SCRIPT_OBSERVAR, seletor)
+    yield
+    try:
+        WebDriverWait(driver, limite, poll_frequency=INTERVALO_ESPERA).until(
+            lambda d: d.execute_script(SCRIPT_MUDOU, QUIETUDE_MS)
+        )
+    except TimeoutException:
+        logger.warning(f"⚠️ '{seletor}' não mudou em {limite}s. Seguindo mesmo assim.")